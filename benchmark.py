@@ -0,0 +1,176 @@
+import argparse
+import time
+from collections import defaultdict, deque
+
+from events import NullSink
+from manager_transaction import TransactionManager, add_deadlock_arguments, deadlock_options_from_args
+from metrics import add_metrics_arguments, metrics_from_args
+from site_log import add_log_arguments, log_settings_from_args
+from site_worker import add_site_worker_arguments
+from workload import add_workload_arguments, workload_from_args
+
+TRANSACTION_COMMANDS = ['begin', 'beginRO', 'R', 'W', 'end']
+
+
+# TransactionManager that records when each transaction begins, commits and aborts.
+class BenchmarkManager(TransactionManager):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.begin_ticks = dict()
+        self.commit_latencies = []
+        self.abort_latencies = []
+        # searches of the waits-for graph and the time they took
+        self.detections = 0
+        self.detection_time = 0
+        # ticks each deadlock or timeout victim waited before it was aborted
+        self.victim_waits = []
+
+    def begin(self, arguments, readonly=False):
+        super().begin(arguments, readonly)
+        self.begin_ticks[arguments.id_trans] = self.ticks
+
+    def beginRO(self, arguments, readonly=True):
+        super().beginRO(arguments, readonly)
+        self.begin_ticks[arguments.id_trans] = self.ticks
+
+    def commit(self, id_trans):
+        super().commit(id_trans)
+        self.commit_latencies.append(self.ticks - self.begin_ticks.pop(id_trans))
+
+    def _detect_deadlocks(self):
+        start = time.perf_counter()
+        try:
+            return super()._detect_deadlocks()
+        finally:
+            self.detections += 1
+            self.detection_time += time.perf_counter() - start
+
+    def _break_deadlock(self, id_trans, reason):
+        waited = super()._break_deadlock(id_trans, reason)
+        self.victim_waits.append(waited)
+        return waited
+
+    def abort(self, id_trans, reason=None):
+        known = id_trans in self.activeTransactions
+        super().abort(id_trans, reason)
+        if known:
+            self.abort_latencies.append(self.ticks - self.begin_ticks.pop(id_trans))
+
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+# Drive manager with lines like a set of closed-loop clients: a transaction's next line is held
+# back while one of its operations is blocked, and lines of finished transactions are dropped.
+# Returns a dict of throughput and latency statistics.
+def run_benchmark(lines, manager):
+    held = defaultdict(deque)
+    released = deque()
+    # transactions with a line waiting in released
+    releasing = set()
+    finished = set()
+    blocked = set()
+    tick_times = []
+    lines = iter(lines)
+
+    while True:
+        from_stream = len(released) == 0
+        if from_stream:
+            line = next(lines, None)
+            if line is None:
+                break
+        else:
+            line = released.popleft()
+        command = manager.parser.parse_line(line) if isinstance(line, str) else line
+        if not from_stream and command is not None:
+            releasing.discard(command.id_trans)
+        if command is not None and command.op in TRANSACTION_COMMANDS:
+            id_trans = command.id_trans
+            if id_trans in finished:
+                continue
+            if command.op not in ['begin', 'beginRO'] and id_trans not in manager.activeTransactions:
+                # aborted by an operation of another transaction
+                finished.add(id_trans)
+                continue
+            if from_stream and (id_trans in blocked or id_trans in held or id_trans in releasing):
+                held[id_trans].append(command)
+                continue
+
+        start = time.perf_counter()
+        manager.getNextOperation(command)
+        tick_times.append(time.perf_counter() - start)
+
+        if command is not None and command.op in TRANSACTION_COMMANDS and command.id_trans not in manager.activeTransactions:
+            finished.add(command.id_trans)
+        blocked = {cmd.id_trans for cmd in manager.commands}
+        for id_trans in list(held):
+            if id_trans not in manager.activeTransactions and id_trans not in blocked:
+                # aborted while its lines were held back
+                finished.add(id_trans)
+                del held[id_trans]
+            elif id_trans not in blocked and id_trans not in releasing:
+                releasing.add(id_trans)
+                released.append(held[id_trans].popleft())
+                if len(held[id_trans]) == 0:
+                    del held[id_trans]
+
+    wall_time = sum(tick_times)
+    commits = len(manager.commit_latencies)
+    aborts = len(manager.abort_latencies)
+    finished_count = max(commits + aborts, 1)
+    latencies = manager.commit_latencies
+    return {
+        'ops': len(tick_times),
+        'wall_time_s': wall_time,
+        'ops_per_sec': len(tick_times) / wall_time if wall_time > 0 else 0,
+        'commits': commits,
+        'aborts': aborts,
+        'commit_rate': commits / finished_count,
+        'abort_rate': aborts / finished_count,
+        'unfinished': len(manager.activeTransactions),
+        'latency_ticks_mean': sum(latencies) / len(latencies) if len(latencies) > 0 else 0,
+        'latency_ticks_p50': percentile(latencies, 0.5),
+        'latency_ticks_p99': percentile(latencies, 0.99),
+        'tick_time_us_mean': 1e6 * wall_time / len(tick_times) if len(tick_times) > 0 else 0,
+        'tick_time_us_p50': 1e6 * percentile(tick_times, 0.5),
+        'tick_time_us_p99': 1e6 * percentile(tick_times, 0.99),
+        'detections': manager.detections,
+        'detection_share': manager.detection_time / wall_time if wall_time > 0 else 0,
+        'victim_aborts': len(manager.victim_waits),
+        'victim_wait_ticks_mean': sum(manager.victim_waits) / len(manager.victim_waits) if len(manager.victim_waits) > 0 else 0,
+        'victim_wait_ticks_p99': percentile(manager.victim_waits, 0.99),
+    }
+
+
+def main(args):
+    lines = list(workload_from_args(args))
+    # engine output is not part of what is measured
+    manager = BenchmarkManager(args.sites, args.variables, sink=NullSink(), site_workers=args.site_workers,
+                               durability=log_settings_from_args(args),
+                               **deadlock_options_from_args(args))
+    metrics = metrics_from_args(args)
+    if metrics is not None:
+        manager.enable_metrics(metrics)
+    try:
+        stats = run_benchmark(lines, manager)
+    finally:
+        manager.close()
+    for key, value in stats.items():
+        print(f'{key}: {value:.3f}' if isinstance(value, float) else f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='run a synthetic workload and report throughput and latency')
+    add_workload_arguments(parser)
+    add_site_worker_arguments(parser)
+    add_deadlock_arguments(parser)
+    add_log_arguments(parser)
+    add_metrics_arguments(parser)
+
+    args = parser.parse_args()
+    main(args)
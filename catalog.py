@@ -0,0 +1,51 @@
+from bisect import insort
+from collections import defaultdict
+
+
+# Maps each variable to the ids of its replica sites and of the replicas that are currently up,
+# so reads and writes go straight to the relevant sites. Entries are built on first use and kept
+# current by site_failed and site_recovered.
+class Catalog:
+    def __init__(self, topology):
+        self.topology = topology
+        # variable -> ids of all sites storing it, in order
+        self.replicas = dict()
+        # variable -> ids of its replica sites that are up, in order
+        self.up_replicas = dict()
+        # site_id -> variables in the catalog that are stored at that site
+        self.site_variables = defaultdict(set)
+        # ids of the sites that are down
+        self.down_sites = set()
+
+    def _load(self, variable):
+        replicas = tuple(self.topology.sites_for(variable))
+        self.replicas[variable] = replicas
+        self.up_replicas[variable] = [site_id for site_id in replicas if site_id not in self.down_sites]
+        for site_id in replicas:
+            self.site_variables[site_id].add(variable)
+
+    # Ids of all sites storing variable
+    def replica_sites(self, variable):
+        if variable not in self.replicas:
+            self._load(variable)
+        return self.replicas[variable]
+
+    # Ids of the up sites storing variable
+    def up_sites(self, variable):
+        if variable not in self.replicas:
+            self._load(variable)
+        return self.up_replicas[variable]
+
+    def site_failed(self, site_id):
+        if site_id in self.down_sites:
+            return
+        self.down_sites.add(site_id)
+        for variable in self.site_variables[site_id]:
+            self.up_replicas[variable].remove(site_id)
+
+    def site_recovered(self, site_id):
+        if site_id not in self.down_sites:
+            return
+        self.down_sites.discard(site_id)
+        for variable in self.site_variables[site_id]:
+            insort(self.up_replicas[variable], site_id)
@@ -0,0 +1,131 @@
+import json
+import sys
+from dataclasses import dataclass, field
+
+# Event levels, lowest is most verbose
+DEBUG = 10  # every new and retried operation
+INFO = 20  # lock and site waits, writes, deadlocks
+RESULT = 30  # read values, commits, aborts and dumps
+QUIET = 100  # above every event
+
+LEVELS = {'debug': DEBUG, 'info': INFO, 'result': RESULT, 'quiet': QUIET}
+
+
+@dataclass(slots=True)
+class Event:
+    kind: str
+    level: int
+    tick: int
+    fields: dict = field(default_factory=dict)
+
+
+# Human readable text of each kind of event
+FORMATS = {
+    'new_op': "NEW OP {command}",
+    'retry': "TRY EXEC OP [{op!r}, {id_trans!r}, {id_val!r}]",
+    'read': "trans {id_trans} read {id_val} from {site_id} val {value}\n{id_trans}: {value}",
+    'lock_wait': "Couldn't obtain {lock} lock for trans {id_trans} on variable {id_val}",
+    'site_wait': "Transaction {id_trans} waiting for site {site_id} to recover for readonly",
+    'write': "trans {id_trans} with Operation(op='WRITE', id_trans={id_trans!r}, id_val={id_val!r}, value='{value}') writes to {sites}",
+    'no_sites': "no sites to write []",
+    'deadlock': "deadlock dected, aborting: {id_trans}",
+    'timeout': "waited {waited} ticks, aborting: {id_trans}",
+    'abort': "{id_trans} aborted",
+    'not_active': "{id_trans} is not active, ignoring {op}",
+    'commit': "{id_trans} commited",
+}
+
+
+def format_event(event):
+    if event.kind == 'dump':
+        lines = ['dumps:']
+        for site in event.fields['sites']:
+            values = ', '.join(f'{k}:{v}' for k, v in site['values'].items())
+            lines.append(f"site_id {site['site_id']} up: {site['up']} — {values}")
+        return '\n'.join(lines)
+    return FORMATS[event.kind].format(**event.fields)
+
+
+# Receives events at or above level. Subclasses override emit.
+class EventSink:
+    level = DEBUG
+
+    def emit(self, event):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+# Drops every event.
+class NullSink(EventSink):
+    level = QUIET
+
+
+# Writes the human readable text of each event to stream, stdout by default.
+class TextSink(EventSink):
+    def __init__(self, stream=None, level=DEBUG):
+        self.stream = stream
+        self.level = level
+
+    def emit(self, event):
+        print(format_event(event), file=self.stream if self.stream is not None else sys.stdout)
+
+
+# Keeps events in memory, for callers that inspect results programmatically.
+class ListSink(EventSink):
+    def __init__(self, level=DEBUG):
+        self.level = level
+        self.events = []
+
+    def emit(self, event):
+        self.events.append(event)
+
+
+# Appends one JSON object per event to path, buffering buffer_size events between writes.
+class JsonlSink(EventSink):
+    def __init__(self, path, level=DEBUG, buffer_size=1024):
+        self.level = level
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.file = open(path, 'w')
+
+    def emit(self, event):
+        record = {'kind': event.kind, 'tick': event.tick}
+        record.update(event.fields)
+        self.buffer.append(json.dumps(record, default=str))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.file.write('\n'.join(self.buffer) + '\n')
+            self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+# Forwards each event to every sink whose level it meets.
+class MultiSink(EventSink):
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self.level = min([sink.level for sink in sinks], default=QUIET)
+
+    def emit(self, event):
+        for sink in self.sinks:
+            if event.level >= sink.level:
+                sink.emit(event)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
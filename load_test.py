@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import random
+import time
+
+from benchmark import percentile
+from server import DEFAULT_HOST, DEFAULT_PORT
+from topology import DEFAULT_NUM_VARIABLES
+
+
+# Send one line and wait for its 'ok' or 'error', returning the other lines received meanwhile
+async def request(reader, writer, line):
+    writer.write((line + '\n').encode())
+    await writer.drain()
+    received = []
+    while True:
+        reply = (await reader.readline()).decode().rstrip('\n')
+        if reply == 'ok' or reply.startswith('error') or reply == '':
+            return received
+        received.append(reply)
+
+
+# One client running transactions back to back, recording the latency of every operation
+async def run_client(client_no, args, latencies, outcomes):
+    rng = random.Random(None if args.seed is None else args.seed + client_no)
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    for i in range(args.transactions):
+        id_trans = f'C{client_no}_{i}'
+        lines = [f'begin({id_trans})']
+        for _ in range(args.ops):
+            variable = f'x{rng.randint(1, args.variables)}'
+            if rng.random() < args.write_fraction:
+                lines.append(f'W({id_trans},{variable},{rng.randint(0, 9999)})')
+            else:
+                lines.append(f'R({id_trans},{variable})')
+        lines.append(f'end({id_trans})')
+
+        for line in lines:
+            start = time.perf_counter()
+            received = await request(reader, writer, line)
+            latencies.append(time.perf_counter() - start)
+            if f'{id_trans} aborted' in received:
+                outcomes['aborted'] += 1
+                break
+            if f'{id_trans} commited' in received:
+                outcomes['commited'] += 1
+    writer.close()
+
+
+async def run(args):
+    latencies = []
+    outcomes = {'commited': 0, 'aborted': 0}
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(c, args, latencies, outcomes) for c in range(args.clients)])
+    elapsed = time.perf_counter() - start
+    print(f'clients: {args.clients}')
+    print(f'ops: {len(latencies)}')
+    print(f'ops_per_sec: {len(latencies) / elapsed:.3f}')
+    print(f"commits: {outcomes['commited']}")
+    print(f"aborts: {outcomes['aborted']}")
+    print(f'latency_ms_p50: {1000 * percentile(latencies, 0.5):.3f}')
+    print(f'latency_ms_p99: {1000 * percentile(latencies, 0.99):.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='load test a running server.py with concurrent clients')
+
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST, help='server address')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='server port')
+    parser.add_argument('-c', '--clients', type=int, default=10, help='concurrent client connections')
+    parser.add_argument('-n', '--transactions', type=int, default=100, help='transactions per client')
+    parser.add_argument('--ops', type=int, default=5, help='reads and writes per transaction')
+    parser.add_argument('--write-fraction', type=float, default=0.5, help='fraction of operations that are writes')
+    parser.add_argument('--variables', type=int, default=DEFAULT_NUM_VARIABLES, help='number of variables to pick from')
+    parser.add_argument('--seed', type=int, help='random seed')
+
+    args = parser.parse_args()
+    asyncio.run(run(args))
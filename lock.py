@@ -1,11 +1,12 @@
+from collections import deque
 from dataclasses import dataclass, field
 from typing import Any, List
 
 from lock_type import LockType
 
 
-@dataclass
+@dataclass(slots=True)
 class Lock:
     lock_type: LockType
-    lock_queue: List = field(default_factory=list)
+    lock_queue: deque = field(default_factory=deque)
     lock_owners: List = field(default_factory=list)
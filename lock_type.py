@@ -2,5 +2,5 @@ from enum import Enum
 
 
 class LockType(Enum):
-    RLOCK = 0,
+    RLOCK = 0
     WLOCK = 1
@@ -1,12 +1,190 @@
+from collections import Counter, defaultdict
+
 from lock import Lock
 from lock_type import LockType
+from waits_for_graph import WaitsForGraph
 
 
 # Handle locks on data items for a given site.
 class LockTable:
-    def __init__(self):
+    def __init__(self, site_id=None, wait_registry=None, global_graph=None):
         # lock table is hash table for all (variable, lock) pairs
         self.lock_table = dict()
+        # site owning this table and registry of operations waiting on its locks
+        self.site_id = site_id
+        self.wait_registry = wait_registry
+        # waits-for edges contributed by each variable, kept up to date as locks change
+        self.variable_edges = dict()
+        # waits-for graph of this site and the graph merged over all sites
+        self.dep_graph = WaitsForGraph()
+        self.global_graph = global_graph
+        # reverse index: transaction_id -> variables whose lock it holds
+        self.held_locks = defaultdict(set)
+        # reverse index: transaction_id -> Counter of variable -> entries it has in that lock's queue
+        self.queued_locks = defaultdict(Counter)
+        # variable -> number of write requests in its lock's queue
+        self.queued_writes = Counter()
+        # variables whose owners or queue shrank since the last dequeue, so may be grantable
+        self.dirty_variables = set()
+
+    # Wake operations waiting on variable after its lock changed state
+    def _notify(self, variable):
+        if self.wait_registry is not None:
+            self.wait_registry.notify(self.site_id, variable)
+
+    # Waits-for edges of a queue entry on the current owners of lock
+    def _owner_edges(self, lock, entry):
+        transaction_id, lock_type = entry
+        if len(lock.lock_owners) == 0:
+            return []
+        if lock_type == LockType.WLOCK:
+            return [(transaction_id, owner) for owner in lock.lock_owners if owner != transaction_id]
+        if lock.lock_type == LockType.WLOCK:
+            return [(transaction_id, lock.lock_owners[0])]
+        return []
+
+    # Waits-for edges between the queue entry at index and the other entries it conflicts with. A write
+    # conflicts with every entry, a read only with the writes, so the scan for a read stops after the
+    # last queued write and is skipped when there is none.
+    def _queue_edges(self, variable, queue, index):
+        transaction_id, lock_type = queue[index]
+        edges = []
+        if lock_type == LockType.WLOCK:
+            for i, (other_id, other_type) in enumerate(queue):
+                if i != index:
+                    edges.append((transaction_id, other_id) if i < index else (other_id, transaction_id))
+            return edges
+        writes = self.queued_writes[variable]
+        for i, (other_id, other_type) in enumerate(queue):
+            if writes == 0:
+                break
+            if other_type == LockType.WLOCK:
+                writes -= 1
+                edges.append((transaction_id, other_id) if i < index else (other_id, transaction_id))
+        return edges
+
+    # Transactions of the write requests queued for variable, in queue order, scanning no further than the last one
+    def _queued_writes_of(self, variable):
+        writes = self.queued_writes[variable]
+        if writes == 0:
+            return []
+        transaction_ids = []
+        for waiting_id, lock_type in self.lock_table[variable].lock_queue:
+            if lock_type == LockType.WLOCK:
+                transaction_ids.append(waiting_id)
+                if len(transaction_ids) == writes:
+                    break
+        return transaction_ids
+
+    # Count a write request entering or leaving the queue of variable
+    def _count_write(self, variable, entry, change):
+        if entry[1] == LockType.WLOCK:
+            self.queued_writes[variable] += change
+            if self.queued_writes[variable] <= 0:
+                del self.queued_writes[variable]
+
+    # Count edges of variable up, passing the ones that appear on to the graphs
+    def _add_edges(self, variable, edges):
+        if len(edges) == 0:
+            return
+        counts = self.variable_edges.setdefault(variable, Counter())
+        added = []
+        for edge in edges:
+            counts[edge] += 1
+            if counts[edge] == 1:
+                added.append(edge)
+        for graph in (self.dep_graph, self.global_graph):
+            if graph is not None:
+                graph.add_edges(added)
+
+    # Count edges of variable down, passing the ones that disappear on to the graphs
+    def _remove_edges(self, variable, edges):
+        if len(edges) == 0:
+            return
+        counts = self.variable_edges[variable]
+        removed = []
+        for edge in edges:
+            counts[edge] -= 1
+            if counts[edge] == 0:
+                del counts[edge]
+                removed.append(edge)
+        if len(counts) == 0:
+            del self.variable_edges[variable]
+        for graph in (self.dep_graph, self.global_graph):
+            if graph is not None:
+                graph.remove_edges(removed)
+
+    # Record transaction_id as an owner of the lock on variable. The first owner is waited for by every
+    # conflicting queue entry, a further shared owner only by the queued writes.
+    def _add_owner(self, transaction_id, variable):
+        lock = self.lock_table[variable]
+        lock.lock_owners.append(transaction_id)
+        self.held_locks[transaction_id].add(variable)
+        if len(lock.lock_owners) == 1:
+            edges = [edge for entry in lock.lock_queue for edge in self._owner_edges(lock, entry)]
+        else:
+            edges = [(waiting_id, transaction_id) for waiting_id in self._queued_writes_of(variable)
+                     if waiting_id != transaction_id]
+        self._add_edges(variable, edges)
+
+    # Remove transaction_id from the owners of the lock on variable, with the edges of the queue on it
+    def _remove_owner(self, transaction_id, variable):
+        lock = self.lock_table[variable]
+        first_owner = lock.lock_owners[0] if len(lock.lock_owners) > 0 else None
+        count = lock.lock_owners.count(transaction_id)
+        lock.lock_owners = [trans_id for trans_id in lock.lock_owners if trans_id != transaction_id]
+        new_first_owner = lock.lock_owners[0] if len(lock.lock_owners) > 0 else None
+        added = []
+        removed = []
+        for waiting_id in self._queued_writes_of(variable):
+            if waiting_id != transaction_id:
+                removed.extend([(waiting_id, transaction_id)] * count)
+        if lock.lock_type == LockType.WLOCK and first_owner != new_first_owner:
+            # queued reads wait for the first owner of a write lock
+            for waiting_id, lock_type in lock.lock_queue:
+                if lock_type == LockType.RLOCK:
+                    removed.append((waiting_id, first_owner))
+                    if new_first_owner is not None:
+                        added.append((waiting_id, new_first_owner))
+        self._add_edges(variable, added)
+        self._remove_edges(variable, removed)
+
+    # Queue (transaction_id, lock_type) for variable with its edges on the owners and the entries before it
+    def _append_queue(self, variable, entry):
+        lock = self.lock_table[variable]
+        lock.lock_queue.append(entry)
+        self._count_write(variable, entry, 1)
+        self.queued_locks[entry[0]][variable] += 1
+        self._add_edges(variable, self._queue_edges(variable, lock.lock_queue, len(lock.lock_queue) - 1) +
+                        self._owner_edges(lock, entry))
+
+    # Remove the queue entry at index of the lock on variable together with its edges
+    def _remove_queued(self, variable, index):
+        lock = self.lock_table[variable]
+        entry = lock.lock_queue[index]
+        self._remove_edges(variable, self._queue_edges(variable, lock.lock_queue, index) +
+                           self._owner_edges(lock, entry))
+        if index == 0:
+            lock.lock_queue.popleft()
+        else:
+            del lock.lock_queue[index]
+        self._count_write(variable, entry, -1)
+        return entry
+
+    # Drop count queue entries of transaction_id on variable from the reverse index
+    def _forget_queued(self, transaction_id, variable, count=1):
+        queued = self.queued_locks[transaction_id]
+        queued[variable] -= count
+        if queued[variable] <= 0:
+            del queued[variable]
+        if len(queued) == 0:
+            del self.queued_locks[transaction_id]
+
+    # Remove and return the first (transaction_id, lock_type) waiting in the queue for variable
+    def _pop_queue(self, variable):
+        waiting = self._remove_queued(variable, 0)
+        self._forget_queued(waiting[0], variable)
+        return waiting
 
     # Utility function to check if a variable is locked
     def is_locked(self, variable):
@@ -32,15 +210,15 @@ class LockTable:
             lock = self.lock_table[variable]
         if transaction_id in lock.lock_owners and lock_type == lock.lock_type:
             return
-        if lock.lock_type == LockType.RLOCK or (lock.lock_type == LockType.WLOCK and len(lock.lock_owners) == 0):
-            lock.lock_owners.append(transaction_id)
         self.lock_table[variable] = lock
+        if lock.lock_type == LockType.RLOCK or (lock.lock_type == LockType.WLOCK and len(lock.lock_owners) == 0):
+            self._add_owner(transaction_id, variable)
 
     # Obtain a shared read lock for transaction_id on variable
     def share_lock(self, transaction_id, variable):
         if self.lock_table[variable].lock_type == LockType.RLOCK:
             if transaction_id not in self.lock_table[variable].lock_owners:
-                self.lock_table[variable].lock_owners.append(transaction_id)
+                self._add_owner(transaction_id, variable)
 
     # Promote a read lock to write lock if possible.
     def promote_lock(self, variable, transaction_id):
@@ -49,18 +227,22 @@ class LockTable:
                 if len(self.lock_table[variable].lock_owners) == 1:
                     if transaction_id in self.lock_table[variable].lock_owners:
                         self.lock_table[variable].lock_type = LockType.WLOCK
+                        # queued reads now wait for the owner too
+                        self._add_edges(variable, [(waiting_id, transaction_id)
+                                                   for waiting_id, lock_type in self.lock_table[variable].lock_queue
+                                                   if lock_type == LockType.RLOCK])
 
     # Release all locks held by transaction_id
     def release_locks_by_transaction(self, transaction_id):
-        for variable in self.lock_table.copy():
-            new_owner_list = []
-            for trans_id in self.lock_table[variable].lock_owners:
-                if trans_id != transaction_id:
-                    new_owner_list.append(trans_id)
-            self.lock_table[variable].lock_owners = new_owner_list
+        for variable in self.held_locks.pop(transaction_id, ()):
+            self._remove_owner(transaction_id, variable)
+            lock = self.lock_table[variable]
             # Remove lock for table if no longer useful
-            if len(self.lock_table[variable].lock_owners) == 0 and len(self.lock_table[variable].lock_queue) == 0:
+            if len(lock.lock_owners) == 0 and len(lock.lock_queue) == 0:
                 del self.lock_table[variable]
+            else:
+                self.dirty_variables.add(variable)
+            self._notify(variable)
 
     # Add tuple of (transaction_id, lock_type) to waiting queue for the lock on variable
     def lock_enqueue(self, transaction_id, variable, lock_type):
@@ -70,27 +252,27 @@ class LockTable:
                 lock_already_enqueued = True
                 break
         if not lock_already_enqueued:
-            self.lock_table[variable].lock_queue.append((transaction_id, lock_type))
+            self._append_queue(variable, (transaction_id, lock_type))
 
     # Assumed this function is called only when the a transaction commits or aborts to dequeue locks
     # that may have been waiting for a lock before the transaction holding that lock was committed or
-    # aborted
+    # aborted. Only variables released since the last call can have become grantable.
     def dequeue_waiting_locks(self):
-        for variable in self.lock_table:
-            if len(self.lock_table[variable].lock_queue) > 0:
+        dirty_variables = self.dirty_variables
+        self.dirty_variables = set()
+        for variable in dirty_variables:
+            if variable in self.lock_table and len(self.lock_table[variable].lock_queue) > 0:
                 # Something to dequeue
+                queue_length = len(self.lock_table[variable].lock_queue)
                 if len(self.lock_table[variable].lock_owners) == 0:
                     # If lock_owners is empty enable first lock waiting in queue
-                    self.lock_table[variable].lock_type = self.lock_table[variable].lock_queue[0][1]
-                    self.lock_table[variable].lock_owners.append(
-                        self.lock_table[variable].lock_queue[0][0])
-                    self.lock_table[variable].lock_queue.pop(0)
+                    transaction_id, lock_type = self._pop_queue(variable)
+                    self.lock_table[variable].lock_type = lock_type
+                    self._add_owner(transaction_id, variable)
                 if self.lock_table[variable].lock_type == LockType.RLOCK:
                     # If dequeued lock is a read lock, dequeue all read locks until lock_queue is empty or write lock is encountered
                     while len(self.lock_table[variable].lock_queue) > 0 and self.lock_table[variable].lock_queue[0][1] == LockType.RLOCK:
-                        self.lock_table[variable].lock_owners.append(
-                            self.lock_table[variable].lock_queue[0][0])
-                        self.lock_table[variable].lock_queue.pop(0)
+                        self._add_owner(self._pop_queue(variable)[0], variable)
 
                     if len(self.lock_table[variable].lock_owners) == 1:
                         if len(self.lock_table[variable].lock_queue) > 0:
@@ -99,7 +281,10 @@ class LockTable:
                                     # If dequeued lock is a read lock and next lock in queue is write lock for same transaction, we can promote it
                                     self.promote_lock(
                                         variable, self.lock_table[variable].lock_owners[0])
-                                    self.lock_table[variable].lock_queue.pop(0)
+                                    self._pop_queue(variable)
+
+                if len(self.lock_table[variable].lock_queue) != queue_length:
+                    self._notify(variable)
 
     # Check if theres transaction waiting for a write lock on variable
     def has_waiting_write_lock(self, variable, transaction_id=None):
@@ -110,42 +295,24 @@ class LockTable:
 
     # Unlocks for transaction_id
     def unlock_tid_queue(self, transaction_id):
-        for variable in self.lock_table.keys():
-            new_queue = []
-            for lock in self.lock_table[variable].lock_queue:
-                if lock[0] != transaction_id:
-                    new_queue.append(lock)
-            self.lock_table[variable].lock_queue = new_queue
-
-    # Generates a dependency for graph for deadlock detection
-    def get_dep_graph(self):
-        waits_for_graph = dict()
-
-        # Generate lock graph for the locks in queue with each other.
-        for variable in self.lock_table.keys():
+        for variable in self.queued_locks.pop(transaction_id, ()):
             lock = self.lock_table[variable]
-            for i in range(len(lock.lock_queue)):
-                xlock = lock.lock_queue[i]
-                for ylock in lock.lock_queue[0:i]:
-                    if xlock[1] == LockType.WLOCK or ylock[1] == LockType.WLOCK:
-                        waits_for_graph.setdefault(xlock[0], set()).add(ylock[0])
-
-        # Generate lock graph for the lock_owners with the locks in queue.
-        for variable in self.lock_table.keys():
-            lock = self.lock_table[variable]
-            for conflicting_lock in lock.lock_queue:
-                if lock.lock_type == LockType.WLOCK or conflicting_lock[1] == LockType.WLOCK:
-                    if conflicting_lock[1] == LockType.WLOCK:
-                        for shared_owner in lock.lock_owners:
-                            if shared_owner != conflicting_lock[0]:
-                                waits_for_graph.setdefault(
-                                    conflicting_lock[0], set()).add(shared_owner)
-                    else:
-                        waits_for_graph.setdefault(
-                            conflicting_lock[0], set()).add(lock.lock_owners[0])
-
-        return waits_for_graph
+            for index in reversed(range(len(lock.lock_queue))):
+                if lock.lock_queue[index][0] == transaction_id:
+                    self._remove_queued(variable, index)
+            self.dirty_variables.add(variable)
+            self._notify(variable)
+
+    # Dependency graph for deadlock detection, maintained as locks change
+    def get_dep_graph(self):
+        return self.dep_graph.get_graph()
 
     # Clear the current lock table
     def clear(self):
+        for variable, counts in list(self.variable_edges.items()):
+            self._remove_edges(variable, list(counts.elements()))
         self.lock_table.clear()
+        self.held_locks.clear()
+        self.queued_locks.clear()
+        self.queued_writes.clear()
+        self.dirty_variables.clear()
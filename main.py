@@ -1,30 +1,71 @@
 import argparse
+import io
 import os
+import sys
 
-from manager_transaction import TransactionManager
+from events import LEVELS, JsonlSink, MultiSink, TextSink
+from manager_transaction import TransactionManager, add_deadlock_arguments, deadlock_options_from_args
+from metrics import add_metrics_arguments, metrics_from_args
+from site_log import add_log_arguments, log_settings_from_args
+from site_worker import add_site_worker_arguments
+from topology import add_topology_arguments, placement_from_args
 
 
 def main(args):
 
-    manager = TransactionManager()
+    placement = placement_from_args(args)
+    sinks = []
+    if not args.quiet:
+        sinks.append(TextSink(level=LEVELS[args.level]))
+    if args.trace is not None:
+        sinks.append(JsonlSink(args.trace))
+    sink = MultiSink(sinks)
+    if args.restore is not None:
+        # continue from a snapshot, whose topology replaces the one given by the flags
+        manager = TransactionManager.restore(args.restore, sink)
+    else:
+        durability = log_settings_from_args(args)
+        manager = TransactionManager(args.sites, args.variables, placement, sink, args.site_workers, durability,
+                                     **deadlock_options_from_args(args))
+    metrics = metrics_from_args(args)
+    if metrics is not None:
+        manager.enable_metrics(metrics)
 
+    # read lines lazily from the file, FIFO or stdin, holding at most buffer_size bytes of input
     filepath = args.file
-    with open(filepath, 'r') as f:
-        for line in f:
+    if filepath is None or filepath == '-':
+        f = open(sys.stdin.fileno(), 'r', buffering=args.buffer_size, closefd=False)
+    else:
+        f = open(filepath, 'r', buffering=args.buffer_size)
+    with f:
+        for command in manager.parser.parse_lines(f):
+            manager.getNextOperation(command)
+    if args.snapshot is not None:
+        manager.snapshot(args.snapshot)
+    manager.close()
+    sink.close()
 
-            line = line.rstrip()
-            is_comment = '//' in line
-            if not is_comment:
-                manager.getNextOperation(line)
-
-    print('done!')
+    if not args.quiet:
+        print('done!')
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='input from file or dir')
 
-    parser.add_argument('-f', '--file', type=str, help='path to test file')
+    parser.add_argument('-f', '--file', type=str, help='path to test file or FIFO, stdin if omitted or -')
+    parser.add_argument('--buffer-size', type=int, default=io.DEFAULT_BUFFER_SIZE, help='input buffer size in bytes')
+    parser.add_argument('-q', '--quiet', action='store_true', help='print nothing')
+    parser.add_argument('--level', type=str, default='debug', choices=list(LEVELS),
+                        help='least important output printed: debug, info, result or quiet')
+    parser.add_argument('--trace', type=str, help='write every event as a JSON line to this file')
+    add_topology_arguments(parser)
+    add_site_worker_arguments(parser)
+    add_deadlock_arguments(parser)
+    add_log_arguments(parser)
+    add_metrics_arguments(parser)
+    parser.add_argument('--snapshot', type=str, help='write the simulator state to this file once the input is consumed')
+    parser.add_argument('--restore', type=str, help='start from the simulator state in this snapshot file')
 
     args = parser.parse_args()
     main(args)
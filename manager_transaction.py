@@ -1,18 +1,111 @@
-from collections import defaultdict, deque
+import pickle
+from collections import Counter, deque
 
+from catalog import Catalog
+from events import DEBUG, INFO, RESULT, Event, ListSink, MultiSink, TextSink
+from metrics import Metrics, instrument
 from misc import *
 from op import *
-from parse import parse
+from parse import Parser, is_comment
 from site_manager import SiteManager
+from site_worker import SiteWorkers, fan_out
+from topology import DEFAULT_NUM_SITES, DEFAULT_NUM_VARIABLES, Topology
 from transaction import Transaction, TransState, TransType
+from wait_registry import WaitRegistry
+from waits_for_graph import WaitsForGraph
+
+# deadlock handling: detect cycles in the waits-for graph, or prevent them by start time when a lock is queued
+DETECT = 'detect'
+WAIT_DIE = 'wait-die'
+WOUND_WAIT = 'wound-wait'
+DEADLOCK_POLICIES = [DETECT, WAIT_DIE, WOUND_WAIT]
+# when the detect policy looks for cycles: before every operation, every detect_every ticks, when an edge was
+# added since the last search, when a queued operation has waited wait_timeout ticks, or never, aborting the
+# transactions whose operations waited on a lock for wait_timeout ticks instead
+ALWAYS = 'always'
+PERIODIC = 'periodic'
+ON_EDGE = 'on-edge'
+BLOCKED = 'blocked'
+TIMEOUT = 'timeout'
+DETECTION_MODES = [ALWAYS, PERIODIC, ON_EDGE, BLOCKED, TIMEOUT]
+DEFAULT_DETECT_EVERY = 10
+DEFAULT_WAIT_TIMEOUT = 10
+
+# format version of snapshot files
+SNAPSHOT_VERSION = 5
+# attributes rebuilt on restore instead of being saved in a snapshot
+SNAPSHOT_EXCLUDED = ('sink', 'str_to_op', 'str_to_cmd', 'site_workers')
 
 
 class TransactionManager:
-    def __init__(self):
+    def __init__(self, num_sites=DEFAULT_NUM_SITES, num_variables=DEFAULT_NUM_VARIABLES, placement=None, sink=None, site_workers=0,
+                 durability=None, deadlock_policy=DETECT, detection=ALWAYS, detect_every=DEFAULT_DETECT_EVERY,
+                 wait_timeout=DEFAULT_WAIT_TIMEOUT):
         # init vars
+        # receives read results, lock waits, commits, aborts and dumps; prints them by default
+        self.sink = sink if sink is not None else TextSink()
+        # turns input lines into Commands, interning transaction and variable ids
+        self.parser = Parser()
         self.sites = []
         self.ticks = 0
         self.commands = deque()
+        self._bind_handlers()
+        self.activeTransactions = dict()
+        # start times of active read-only transactions, bounding which versions sites must keep
+        self.readonly_start_times = Counter()
+        # tick of the latest read-write commit; read-only transactions begun after the same one share their snapshot
+        self.last_commit_time = 0
+        # snapshot -> {variable: (site_id, value, start time of the transaction that resolved it)}, and the
+        # number of active read-only transactions on each snapshot
+        self.snapshot_reads = dict()
+        self.snapshot_readers = Counter()
+        # blocked commands by the (site, variable) they wait on
+        self.waits = WaitRegistry()
+        # waits-for graph merged over all sites, maintained by the lock tables
+        self.waits_for = WaitsForGraph()
+        # number of sites and variables and where each variable is placed
+        self.topology = Topology(num_sites, num_variables, placement)
+        # with site_workers > 0 the sites run in that many worker processes instead of in this one
+        self.site_workers = None
+        # LogSettings of the sites' durable logs, or None to keep committed data only in memory
+        self.durability = durability
+        if site_workers > 0:
+            self.site_workers = SiteWorkers(num_sites, site_workers, self.topology, self.waits, self.waits_for,
+                                            durability=durability)
+            self.sites = self.site_workers.sites
+        else:
+            self.sites = [SiteManager(i+1, self.waits, self.waits_for, self.topology,
+                                      durability.open(i+1) if durability is not None else None)
+                          for i in range(0, num_sites)]
+        # replica sites of each variable and the ones that are up
+        self.catalog = Catalog(self.topology)
+        # one of DEADLOCK_POLICIES
+        if deadlock_policy not in DEADLOCK_POLICIES:
+            raise ValueError(f'unknown deadlock policy: {deadlock_policy}, must be in {DEADLOCK_POLICIES}')
+        self.deadlock_policy = deadlock_policy
+        # one of DETECTION_MODES, used by the detect policy
+        if detection not in DETECTION_MODES:
+            raise ValueError(f'unknown detection mode: {detection}, must be in {DETECTION_MODES}')
+        if detect_every < 1 or wait_timeout < 1:
+            raise ValueError('detect_every and wait_timeout must be at least 1 tick')
+        self.detection = detection
+        self.detect_every = detect_every
+        self.wait_timeout = wait_timeout
+        # edges added to the waits-for graph when it was last found acyclic
+        self.detected_edges = 0
+        # counters and latency histograms, None until enable_metrics is called
+        self.metrics = None
+        if durability is not None:
+            # sites restored from existing logs resume after the last time they recorded, in their last up state
+            last_time = max([site.last_logged_time() for site in self.sites])
+            if last_time > 0:
+                self.ticks = last_time + 1
+            for site in self.sites:
+                if not site.up:
+                    self.catalog.site_failed(site.site_id)
+
+    def _bind_handlers(self):
+        # map command names to the methods executing them
         self.str_to_op = {
             'dump': self.dump,
             'fail': self.fail,
@@ -27,13 +120,48 @@ class TransactionManager:
             WRITE: self.write,
             READ: self.read,
         }
-        self.activeTransactions = dict()
-        self.sites = [SiteManager(i+1) for i in range(0, 10)]
+
+    def snapshot(self, path):
+        # write the whole simulation state (sites with their lock tables, versions and write sets,
+        # transactions, queued commands, waits and the clock) to path as one binary pickle
+        if self.site_workers is not None or self.durability is not None:
+            raise ValueError('snapshots need in-process sites without durable logs')
+        if self.metrics is not None:
+            raise ValueError('snapshots of an instrumented manager are not supported')
+        state = {key: value for key, value in self.__dict__.items() if key not in SNAPSHOT_EXCLUDED}
+        with open(path, 'wb') as f:
+            pickle.dump((SNAPSHOT_VERSION, type(self).__name__, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def restore(cls, path, sink=None):
+        # a manager continuing from a snapshot written by snapshot(), sending its events to sink
+        with open(path, 'rb') as f:
+            version, class_name, state = pickle.load(f)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f'snapshot version {version} is not supported, expected {SNAPSHOT_VERSION}')
+        if class_name != cls.__name__:
+            raise ValueError(f'snapshot of a {class_name} can not be restored as a {cls.__name__}')
+        manager = cls.__new__(cls)
+        manager.__dict__.update(state)
+        manager.sink = sink if sink is not None else TextSink()
+        manager.site_workers = None
+        manager._bind_handlers()
+        return manager
+
+    def enable_metrics(self, metrics=None):
+        # start recording counters and latency histograms of the engine's hot paths into metrics
+        self.metrics = metrics if metrics is not None else Metrics()
+        instrument(self, self.metrics)
+        return self.metrics
+
+    def stats(self):
+        # metrics recorded so far, empty unless enable_metrics was called
+        return self.metrics.stats() if self.metrics is not None else {}
 
     def getNextOperation(self, line):
-        # parse and execute a line
+        # parse and execute a line, or a Command already parsed. None or a blank line only ticks
         #print(f'time: {self.ticks}')
-        command = parse(line)
+        command = self.parser.parse_line(line) if isinstance(line, str) else line
         if command is None:
             self._tick()
             return
@@ -46,65 +174,126 @@ class TransactionManager:
         # print('deadlock: ', dl)
 
         if dl:
-            for cmd in list(self.commands):
-                print(f'TRY EXEC OP [{cmd.op},{cmd.id_trans},{cmd.id_val}]')
-                f_cmd = self.str_to_cmd[cmd.op]
-                done = f_cmd(cmd)
-                if done:
-                    self._rmcommand(cmd)
+            self._retry_commands()
 
         # do operation
-        operation_str = command[0]
+        operation_str = command.op
         # get
         op = self.str_to_op[operation_str]
         # call
-        print(f'NEW OP {command}')
+        if DEBUG >= self.sink.level:
+            self._emit(DEBUG, 'new_op', command=command.tokens())
         op(command)
 
-        for cmd in list(self.commands):
-            print(f'TRY EXEC OP [\'{cmd.op}\', \'{cmd.id_trans}\', \'{cmd.id_val}]\'')
-            f_cmd = self.str_to_cmd[cmd.op]
-            done = f_cmd(cmd)
-            if done:
-                self._rmcommand(cmd)
+        self._retry_commands()
+
+        self._tick()
 
+    def idle(self):
+        # advance one tick without a new operation, still breaking deadlocks among queued commands
+        if self.isDeadlocked():
+            self._retry_commands()
         self._tick()
 
+    def idle_ticks(self):
+        # idle ticks after which the deadlock handling has looked at every operation queued now
+        if self.deadlock_policy != DETECT:
+            return 0
+        if self.detection == PERIODIC:
+            return self.detect_every
+        if self.detection in [BLOCKED, TIMEOUT]:
+            return self.wait_timeout
+        return 1
+
+    def stream(self, operations, level=RESULT):
+        # execute lines or Commands from any iterable lazily, yielding the events at or above
+        # level that each one produces as soon as it has run. Comment lines are skipped.
+        collector = ListSink(level)
+        sink = self.sink
+        self.sink = MultiSink([sink, collector])
+        try:
+            for operation in operations:
+                if isinstance(operation, str) and is_comment(operation):
+                    continue
+                self.getNextOperation(operation)
+                if len(collector.events) > 0:
+                    events = collector.events
+                    collector.events = []
+                    yield from events
+        finally:
+            self.sink = sink
+
+    def _emit(self, level, kind, **fields):
+        # hand an event to the sink if it listens at level
+        if level >= self.sink.level:
+            self.sink.emit(Event(kind, level, self.ticks, fields))
+
+    def _retry_commands(self):
+        # retry the queued commands woken since their last attempt, oldest first
+        for cmd in list(self.commands):
+            if not cmd.ready:
+                continue
+            self._emit(DEBUG, 'retry', op=cmd.op, id_trans=cmd.id_trans, id_val=cmd.id_val)
+            self._try_command(cmd)
+
+    def _try_command(self, cmd):
+        # execute a queued command, parking it on its variable's sites if it blocks
+        if cmd.id_trans not in self.activeTransactions:
+            # transaction ended or was aborted earlier in this pass over the queue
+            if cmd in self.commands:
+                self._rmcommand(cmd)
+            return
+        f_cmd = self.str_to_cmd[cmd.op]
+        done = f_cmd(cmd)
+        if done:
+            self._rmcommand(cmd)
+        elif cmd.id_trans in self.activeTransactions:
+            for site_id in self.catalog.replica_sites(cmd.id_val):
+                self.waits.wait(cmd, site_id, cmd.id_val)
+
     def end(self, arguments):
         # end trans, with a commit to db or fatal
-        id_trans = arguments[1]
+        id_trans = arguments.id_trans
+        if id_trans not in self.activeTransactions:
+            # already aborted, e.g. by a deadlock prevention policy
+            self._emit(INFO, 'not_active', id_trans=id_trans, op=arguments.op)
+            return
         if self.activeTransactions.get(id_trans).transactionState == TransState.ABORTED:
-            self.abort(id_trans)
+            self.abort(id_trans, 'site_failure')
             #print(f'{id_trans} aborted')
             return
 
         self.commit(id_trans)
-        print(f'{id_trans} commited')
+        self._emit(RESULT, 'commit', id_trans=id_trans)
         return
 
     def begin(self, arguments, readonly=False):
         # start the transaction
-        id_trans = arguments[1]
+        id_trans = arguments.id_trans
         all_trans = self.activeTransactions
         #print(f'start trans {id_trans} read_only: {readonly}')
         transaction = Transaction(id_trans, self.ticks, (TransType.READ_ONLY if readonly else TransType.READ_WRITE), TransState.RUNNING)
         all_trans[id_trans] = transaction
+        if readonly:
+            self._start_readonly(transaction)
 
     def beginRO(self, arguments, readonly=True):
         # start the transaction
-        id_trans = arguments[1]
+        id_trans = arguments.id_trans
         all_trans = self.activeTransactions
         #print(f'start trans {id_trans} read_only: {readonly}')
         transaction = Transaction(id_trans, self.ticks, (TransType.READ_ONLY if readonly else TransType.READ_WRITE), TransState.RUNNING)
         all_trans[id_trans] = transaction
+        if readonly:
+            self._start_readonly(transaction)
 
     def queue_read(self, command):
         # push a read command into the command queue
 
-        id_trans = command[1]
-        id_val = command[2]
+        id_trans = command.id_trans
+        id_val = command.id_val
 
-        read_o = Operation(READ, id_trans, id_val)
+        read_o = Operation(READ, id_trans, id_val, queued_at=self.ticks)
         self.commands.append(read_o)
 
     def read(self, cmd):
@@ -113,45 +302,59 @@ class TransactionManager:
         trans = self.activeTransactions.get(id_trans)
 
         if trans.transactionType == TransType.READ_WRITE:
-            for site in self.sites:
-                in_site = id_val in site.data
-                if in_site and site.up:
-                    result_value = site.read(id_val, trans)
-                    if result_value[0] is not None:
-                        trans.sitesAccessed.append(site.site_id)
-                        print(f'trans {id_trans} read {id_val} from {site.site_id} val {result_value[0]}')
-                        print(f'{id_trans}: {result_value[0]}')
-                        return True
-                    else:
-                        if result_value[1] is True:
-                            print(f'Couldn\'t obtain read lock for trans {id_trans} on variable {id_val}')
-                            break;
+            for site_id in self.catalog.up_sites(id_val):
+                site = self.sites[site_id - 1]
+                result_value = site.read(id_val, trans)
+                if result_value[0] is not None:
+                    trans.sitesAccessed.add(site.site_id)
+                    trans.sitesTouched.add(site.site_id)
+                    self._emit(RESULT, 'read', id_trans=id_trans, id_val=id_val, site_id=site.site_id, value=result_value[0])
+                    return True
+                else:
+                    if result_value[1] is True:
+                        trans.sitesAccessed.add(site.site_id)
+                        self._emit(INFO, 'lock_wait', lock='read', id_trans=id_trans, id_val=id_val, site_id=site.site_id)
+                        if self._prevent_deadlock(id_trans, site, id_val):
+                            # younger lock holders were wounded, try again
+                            return self.read(cmd)
+                        break;
         else:
+            cached = self.snapshot_reads.get(trans.snapshot, {}).get(id_val)
+            if cached is not None:
+                site_id, value, resolved_at = cached
+                site = self.sites[site_id - 1]
+                # the site kept the version readable for this start time if it has stayed up since resolving it
+                if site.up and (site.start_time <= resolved_at or trans.startTime == resolved_at):
+                    trans.sitesAccessed.add(site_id)
+                    trans.sitesTouched.add(site_id)
+                    self._emit(RESULT, 'read', id_trans=id_trans, id_val=id_val, site_id=site_id, value=value)
+                    return True
             some_site_down = False
-            for site in self.sites:
-                in_site = id_val in site.data
-                if in_site:
-                    if not site.up:
-                        print(f'Transaction {id_trans} waiting for site {site.site_id} to recover for readonly')
-                        some_site_down = True
-                        continue
-                    result_value = site.read(id_val, trans)
-                    if result_value[0] is not None:
-                        trans.sitesAccessed.append(site.site_id)
-                        print(f'trans {id_trans} read {id_val} from {site.site_id} val {result_value[0]}')
-                        print(f'{id_trans}: {result_value[0]}')
-                        return True
+            for site_id in self.catalog.replica_sites(id_val):
+                site = self.sites[site_id - 1]
+                if not site.up:
+                    self._emit(INFO, 'site_wait', id_trans=id_trans, id_val=id_val, site_id=site.site_id)
+                    some_site_down = True
+                    continue
+                result_value = site.read(id_val, trans)
+                if result_value[0] is not None:
+                    trans.sitesAccessed.add(site.site_id)
+                    trans.sitesTouched.add(site.site_id)
+                    self.snapshot_reads.setdefault(trans.snapshot, dict())[id_val] = (site.site_id, result_value[0],
+                                                                                     trans.startTime)
+                    self._emit(RESULT, 'read', id_trans=id_trans, id_val=id_val, site_id=site.site_id, value=result_value[0])
+                    return True
             # No readable value and all sites were up. Abort.
             if not some_site_down:
-                self.abort(id_trans)
+                self.abort(id_trans, 'no_readable_version')
         return False
 
     def queue_write(self, command):
         # push a write command into the command queue
-        id_trans = command[1]
-        id_val = command[2]
-        value = command[3]
-        write_o = Operation(WRITE, id_trans, id_val, value)
+        id_trans = command.id_trans
+        id_val = command.id_val
+        value = command.value
+        write_o = Operation(WRITE, id_trans, id_val, value, queued_at=self.ticks)
         self.commands.append(write_o)
 
     def write(self, cmd):
@@ -159,45 +362,112 @@ class TransactionManager:
         id_trans, id_val, value = cmd.id_trans, cmd.id_val, cmd.value
 
         sites_write = []
+        trans = self.activeTransactions.get(id_trans)
 
-        for site in self.sites:
-            in_site = id_val in site.data
-            if in_site and site.up:
-
-                write_lock = site.test_write_lock(id_trans, id_val)
-                if not write_lock:
-                    print(f'Couldn\'t obtain write lock for trans {id_trans} on variable {id_val}')
-                    return False
-                sites_write.append(int(site.site_id))
+        for site_id in self.catalog.up_sites(id_val):
+            site = self.sites[site_id - 1]
+            write_lock = site.test_write_lock(id_trans, id_val)
+            if not write_lock:
+                # the write lock request is queued at this site
+                if trans is not None:
+                    trans.sitesAccessed.add(site.site_id)
+                self._emit(INFO, 'lock_wait', lock='write', id_trans=id_trans, id_val=id_val, site_id=site.site_id)
+                if self._prevent_deadlock(id_trans, site, id_val):
+                    # younger lock holders were wounded, try again
+                    return self.write(cmd)
+                return False
+            sites_write.append(int(site.site_id))
 
         # no writes
         if len(sites_write) == 0:
-            print('no sites to write', sites_write)
+            self._emit(INFO, 'no_sites', id_trans=id_trans, id_val=id_val)
             return False
 
-        trans = self.activeTransactions[id_trans]
+        fan_out(self._sites(sites_write), 'write', id_trans, id_val, value)
         for site_id in sites_write:
-            self.sites[site_id - 1].write(id_trans, id_val, value)
-            trans.sitesAccessed.append(site_id)
+            trans.sitesAccessed.add(site_id)
+            trans.sitesTouched.add(site_id)
 
-        print(f'trans {id_trans} with {cmd} writes to {sites_write}')
+        self._emit(INFO, 'write', id_trans=id_trans, id_val=id_val, value=value, sites=sites_write)
         return True
 
+    def _prevent_deadlock(self, id_trans, site, id_val):
+        # id_trans just queued for a lock on id_val at site. Under wait-die it may only wait for younger
+        # transactions and aborts otherwise; under wound-wait it aborts the younger ones it waits for.
+        # Returns True if other transactions were aborted, so the request may now succeed.
+        if self.deadlock_policy == DETECT:
+            return False
+        trans = self.activeTransactions[id_trans]
+        priority = (trans.startTime, id_trans)
+        blockers = [self.activeTransactions[blocker] for blocker in sorted(site.blockers(id_trans, id_val))
+                    if blocker in self.activeTransactions]
+        if self.deadlock_policy == WAIT_DIE:
+            if any((blocker.startTime, blocker.id_trans) < priority for blocker in blockers):
+                self.abort(id_trans, 'died')
+            return False
+        wounded = [blocker.id_trans for blocker in blockers if (blocker.startTime, blocker.id_trans) > priority]
+        for blocker in wounded:
+            self.abort(blocker, 'wounded')
+        return len(wounded) > 0
+
     def isDeadlocked(self):
+        # break deadlocks if the detection mode calls for it now, returning whether any transaction was aborted
+        if self.deadlock_policy != DETECT:
+            # prevention policies never let a cycle form
+            return False
+        if self.detection == TIMEOUT:
+            return self._abort_timed_out()
+        if self.detection != ALWAYS:
+            if self.waits_for.added == self.detected_edges:
+                # only an added edge can close a cycle, and none was added since the graph was found acyclic
+                return False
+            if self.detection == PERIODIC and self.ticks % self.detect_every != 0:
+                return False
+            if self.detection == BLOCKED and (len(self.commands) == 0 or
+                                              self.ticks - self.commands[0].queued_at < self.wait_timeout):
+                return False
+        return self._detect_deadlocks()
+
+    def _detect_deadlocks(self):
+        # peform deadlock dection, aborting the youngest transaction of every cycle
+        # until the waits-for graph is acyclic
         res = False
-        # peform deadlock dection
-        blocking = build_deps(self.sites)
-        deadlock = detect_dl(self.activeTransactions, blocking)
-        if deadlock is not None:
-            print(f'deadlock dected, aborting: {deadlock}')
-            self.abort(deadlock)
+        while True:
+            blocking = self.waits_for.get_graph()
+            victims = detect_dl(self.activeTransactions, blocking)
+            if len(victims) == 0:
+                break
+            for deadlock in victims:
+                self._break_deadlock(deadlock, 'deadlock')
             res = True
+        self.detected_edges = self.waits_for.added
+        return res
 
+    def _abort_timed_out(self):
+        # abort the transactions with an operation queued on a lock for at least wait_timeout ticks
+        res = False
+        for op in list(self.commands):
+            if self.ticks - op.queued_at < self.wait_timeout:
+                # the queue is in the order operations arrived
+                break
+            if op.id_trans in self.activeTransactions and op.id_trans in self.waits_for.edges:
+                self._break_deadlock(op.id_trans, 'timeout')
+                res = True
         return res
 
-    def abort(self, id_trans):
-        # perform abort
-        [site.abort(id_trans) for site in self.sites]
+    def _break_deadlock(self, id_trans, reason):
+        # abort a deadlocked or timed out transaction, returning the ticks its oldest queued operation waited
+        waited = max([self.ticks - op.queued_at for op in self.commands if op.id_trans == id_trans], default=0)
+        self._emit(INFO, reason, id_trans=id_trans, waited=waited)
+        self.abort(id_trans, reason)
+        return waited
+
+    def abort(self, id_trans, reason=None):
+        # perform abort on the sites the transaction holds or waits for locks at
+        trans = self.activeTransactions.get(id_trans)
+        if trans is not None:
+            fan_out(self._sites(sorted(trans.sitesAccessed)), 'abort', id_trans)
+        self._end_readonly(trans)
 
         # remove trans from active
         # print('abort',  self.activeTransactions)
@@ -206,47 +476,104 @@ class TransactionManager:
             if key != id_trans:
                 new_active_trans[key] = value
         self.activeTransactions = new_active_trans
+        self.parser.transactions.release(id_trans)
         for op in list(self.commands):
             if op.id_trans == id_trans:
                 self._rmcommand(op)
 
-        print(f'{id_trans} aborted')
+        self._emit(RESULT, 'abort', id_trans=id_trans, reason=reason)
 
     def fail(self, arguments):
-        site_id = int(arguments[1])
+        site_id = arguments.site_id
 
         # kill trans for site
         for trans in self.activeTransactions.values():
-            if site_id in trans.sitesAccessed and trans.transactionType == TransType.READ_WRITE:
+            if site_id in trans.sitesTouched and trans.transactionType == TransType.READ_WRITE:
                 trans.transactionState = TransState.ABORTED
 
         # cause a site to fail
         #print(f'fail on {site_id}')
         ts = self.ticks
+        self.catalog.site_failed(site_id)
         self.sites[site_id - 1].fail(ts)
 
     def recover(self, arguments):
         # recover site
-        site_id = int(arguments[1])
+        site_id = arguments.site_id
         #print(f'recover site {site_id}')
         ts = self.ticks
+        self.catalog.site_recovered(site_id)
         self.sites[site_id - 1].recover(ts)
 
     def commit(self, id_trans):
         # perofrm the commit for id_trans
         time = self.ticks
         #print(f'{id_trans} commits, time: {time}')
-        [site.commit(id_trans, time) for site in self.sites]
-        self.activeTransactions.pop(id_trans)
+        horizon = self._gc_horizon()
+        trans = self.activeTransactions[id_trans]
+        fan_out(self._sites(sorted(trans.sitesAccessed)), 'commit', id_trans, time, horizon)
+        if trans.transactionType == TransType.READ_WRITE:
+            self.last_commit_time = time
+        self._end_readonly(self.activeTransactions.pop(id_trans))
+        self.parser.transactions.release(id_trans)
+        # operations still queued by the transaction can no longer run
+        for op in list(self.commands):
+            if op.id_trans == id_trans:
+                self._rmcommand(op)
+
+    def _gc_horizon(self):
+        # start of the oldest active read-only transaction, None if there is none
+        if len(self.readonly_start_times) == 0:
+            return None
+        return min(self.readonly_start_times)
+
+    def _start_readonly(self, trans):
+        # register the snapshot of a new read-only transaction, which holds back garbage collection
+        self.readonly_start_times[trans.startTime] += 1
+        # versions committed at the start tick itself are not visible, which only happens to the initial
+        # ones at tick 0, so such a transaction does not share the snapshot of the transactions after it
+        trans.snapshot = self.last_commit_time if trans.startTime > self.last_commit_time else -1
+        self.snapshot_readers[trans.snapshot] += 1
+
+    def _end_readonly(self, trans):
+        # once the oldest read-only snapshot is gone, sites can drop the versions only it could read
+        if trans is None or trans.transactionType != TransType.READ_ONLY:
+            return
+        oldest = self._gc_horizon()
+        self.readonly_start_times[trans.startTime] -= 1
+        if self.readonly_start_times[trans.startTime] <= 0:
+            del self.readonly_start_times[trans.startTime]
+        # cached reads of a snapshot go with its last reader, before the horizon can move past their versions
+        self.snapshot_readers[trans.snapshot] -= 1
+        if self.snapshot_readers[trans.snapshot] <= 0:
+            del self.snapshot_readers[trans.snapshot]
+            self.snapshot_reads.pop(trans.snapshot, None)
+        if trans.startTime == oldest and self._gc_horizon() != oldest:
+            horizon = self._gc_horizon()
+            fan_out(self.sites, 'collect_garbage', horizon)
 
     def dump(self, *args):
         # dump state of simulatiom
-        print('dumps:')
-        [site.dump() for site in self.sites]
+        if RESULT >= self.sink.level:
+            self._emit(RESULT, 'dump', sites=fan_out(self.sites, 'dump'))
+
+    def _sites(self, site_ids):
+        # sites with the given ids
+        return [self.sites[site_id - 1] for site_id in site_ids]
+
+    def close(self):
+        # stop the site worker processes, if any, close the site logs and write the final metrics
+        if self.metrics is not None:
+            self.metrics.close()
+        if self.site_workers is not None:
+            self.site_workers.close()
+        else:
+            [site.close() for site in self.sites]
 
     def _rmcommand(self, c):
-        # removes command
+        # removes command, and stops waiting for it
         self.commands.remove(c)
+        self.waits.remove(c)
 
     def _tick(self):
         self.ticks += 1
@@ -254,51 +581,36 @@ class TransactionManager:
 
 
 def detect_dl(t_dict, dep_graph):
-    # check for cycle and evict youngest
-
-    dep_trans = []
-    for k in dep_graph.keys():
-        dep_trans.append(k)
-
-    cycle_trans = []  # keep track of trans with cycle
-
-    for transaction in dep_trans:
-        if node_in_cycle(transaction, dep_graph):
-            cycle_trans.append(transaction)
-
-    min_time = -1
-    min_id = None
-
-    # print('cycles', cycle_trans)
-    # find min
-    for t_id in cycle_trans:
-        trans = t_dict[t_id]
-        if trans.startTime > min_time:
-            min_time = trans.startTime
-            min_id = t_id
-
-    # print('victim', min_id)
-    return min_id
-
-
-def build_deps(sites):
-    # build dependcies
-    up_sites = get_up_sites(sites)
-    dep_g = defaultdict(set)
-
-    site_graphs = [s.get_dep_graph() for s in up_sites]
-
-    for g in site_graphs:
-        for key in g.keys():
-            value = g[key]
-            dep_g[key].update(value)
-            # if key in dep_g:
-            #     dep_g[key].append(value)
-            # else:
-            #     dep_g[key] = [value]
-
-    # # convert to set for unique
-    # for key in dep_g.keys():
-    #     print(dep_g[key])
-    #     # dep_g[key] = set(dep_g[key])
-    return dep_g
+    # find every cycle and evict the youngest transaction of each
+
+    victims = []
+    for cycle_trans in find_cycles(dep_graph):
+        max_time = -1
+        max_id = None
+        for t_id in cycle_trans:
+            # a transaction can end while its operation is still queued, leaving its edges behind
+            trans = t_dict.get(t_id)
+            if trans is not None and trans.startTime > max_time:
+                max_time = trans.startTime
+                max_id = t_id
+        if max_id is not None:
+            victims.append(max_id)
+
+    return victims
+
+
+def add_deadlock_arguments(parser):
+    parser.add_argument('--deadlock-policy', type=str, default=DETECT, choices=DEADLOCK_POLICIES,
+                        help='detect cycles in the waits-for graph, or prevent them with wait-die or wound-wait')
+    parser.add_argument('--detection', type=str, default=ALWAYS, choices=DETECTION_MODES,
+                        help='when the detect policy searches for cycles, or timeout to abort long waits instead')
+    parser.add_argument('--detect-every', type=int, default=DEFAULT_DETECT_EVERY,
+                        help='ticks between searches with --detection periodic')
+    parser.add_argument('--wait-timeout', type=int, default=DEFAULT_WAIT_TIMEOUT,
+                        help='ticks a queued operation waits before --detection blocked searches or timeout aborts')
+
+
+# Deadlock keyword arguments of TransactionManager from parsed arguments
+def deadlock_options_from_args(args):
+    return {'deadlock_policy': args.deadlock_policy, 'detection': args.detection,
+            'detect_every': args.detect_every, 'wait_timeout': args.wait_timeout}
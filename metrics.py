@@ -0,0 +1,282 @@
+import cProfile
+import functools
+import json
+import time
+from collections import Counter
+
+# LockTable methods timed by instrument, by metric name
+LOCK_TABLE_METHODS = {
+    'lock.acquire': 'lock',
+    'lock.share': 'share_lock',
+    'lock.enqueue': 'lock_enqueue',
+    'lock.grant': 'dequeue_waiting_locks',
+    'lock.promote': 'promote_lock',
+}
+# SiteManager methods timed by instrument, by metric name
+SITE_METHODS = {
+    'site.rw_read': 'rw_read',
+    'site.ro_read': 'ro_read',
+    'site.test_write_lock': 'test_write_lock',
+    'site.write': 'write',
+    'site.commit': 'commit',
+    'site.abort': 'abort',
+}
+
+
+# Counts of values in power of two buckets: bucket b holds values v with v.bit_length() == b.
+# Percentiles are reported as the upper bound of their bucket, capped at the largest value seen.
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * 65
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.buckets[min(int(value).bit_length(), 64)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        if self.count == 0:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min((1 << bucket) - 1, self.max)
+        return self.max
+
+    def summary(self, scale=1):
+        if self.count == 0:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': self.total / self.count / scale,
+            'p50': self.percentile(0.5) / scale,
+            'p99': self.percentile(0.99) / scale,
+            'max': self.max / scale,
+        }
+
+
+# Counters and histograms of a TransactionManager, filled in by instrument. Durations are
+# recorded in nanoseconds and reported in microseconds. With path set, a JSON line of stats is
+# appended to it every `every` ticks (when every > 0) and when the metrics are closed. With
+# profile set, getNextOperation runs under cProfile and the profile is written there on close.
+class Metrics:
+    def __init__(self, path=None, every=0, profile=None):
+        self.path = path
+        self.every = every
+        self.profile = profile
+        self.profiler = cProfile.Profile() if profile is not None else None
+        self.counters = Counter()
+        # histograms of durations in ns, by name
+        self.timings = dict()
+        # histograms of counts and tick durations, by name
+        self.values = dict()
+        # current length of the command queue
+        self.queue_length = 0
+        self.manager = None
+        # id of a queued operation -> (tick, perf_counter_ns) when it was queued, attempts so far
+        self.queued = dict()
+        # id_trans -> (blocked ticks, blocked ns) summed over its finished operations
+        self.blocked = dict()
+
+    def time(self, name, elapsed_ns):
+        histogram = self.timings.get(name)
+        if histogram is None:
+            histogram = self.timings[name] = Histogram()
+        histogram.observe(elapsed_ns)
+
+    def observe(self, name, value):
+        histogram = self.values.get(name)
+        if histogram is None:
+            histogram = self.values[name] = Histogram()
+        histogram.observe(value)
+
+    # Everything recorded so far as plain data
+    def stats(self):
+        return {
+            'ticks': self.manager.ticks if self.manager is not None else 0,
+            'queue_length': self.queue_length,
+            'counters': dict(self.counters),
+            'timings_us': {name: histogram.summary(1000) for name, histogram in sorted(self.timings.items())},
+            'values': {name: histogram.summary() for name, histogram in sorted(self.values.items())},
+        }
+
+    def write_snapshot(self):
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(self.stats()) + '\n')
+
+    def close(self):
+        self.write_snapshot()
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.profile)
+
+
+# Replace obj.name by a wrapper recording the duration of every call under metric
+def _time_method(obj, name, metrics, metric):
+    method = getattr(obj, name)
+
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            metrics.time(metric, time.perf_counter_ns() - start)
+
+    setattr(obj, name, timed)
+
+
+# Count calls of obj.name under counter
+def _count_method(obj, name, metrics, counter):
+    method = getattr(obj, name)
+
+    @functools.wraps(method)
+    def counted(*args, **kwargs):
+        metrics.counters[counter] += 1
+        return method(*args, **kwargs)
+
+    setattr(obj, name, counted)
+
+
+# Hook metrics into manager and its in-process sites by wrapping methods on the instances, so
+# nothing is measured, and nothing costs, unless a manager is instrumented. Sites running in
+# worker processes only get the manager level metrics.
+def instrument(manager, metrics):
+    metrics.manager = manager
+    for site in manager.sites:
+        if not hasattr(site, 'lock_table'):
+            continue
+        for metric, name in SITE_METHODS.items():
+            _time_method(site, name, metrics, metric)
+        for metric, name in LOCK_TABLE_METHODS.items():
+            _time_method(site.lock_table, name, metrics, metric)
+        _count_method(site.lock_table, '_pop_queue', metrics, 'lock.granted')
+
+    _time_method(manager, 'isDeadlocked', metrics, 'deadlock_check')
+    _time_method(manager, '_detect_deadlocks', metrics, 'deadlock_detection')
+    _instrument_deadlock_aborts(manager, metrics)
+    _instrument_queue(manager, metrics)
+    _instrument_transactions(manager, metrics)
+    _instrument_operations(manager, metrics)
+    # the command table holds bound methods, rebind it to the wrappers
+    manager._bind_handlers()
+
+
+# Time each queued operation until it leaves the queue and count its attempts
+def _instrument_queue(manager, metrics):
+    for name in ['queue_read', 'queue_write']:
+        queue = getattr(manager, name)
+
+        def queued(command, queue=queue):
+            queue(command)
+            metrics.queued[id(manager.commands[-1])] = (manager.ticks, time.perf_counter_ns(), 0)
+
+        setattr(manager, name, queued)
+
+    try_command = manager._try_command
+
+    def attempted(cmd):
+        entry = metrics.queued.get(id(cmd))
+        if entry is not None:
+            metrics.queued[id(cmd)] = (entry[0], entry[1], entry[2] + 1)
+        metrics.counters['op.attempts'] += 1
+        return try_command(cmd)
+
+    manager._try_command = attempted
+
+    remove_command = manager._rmcommand
+
+    def removed(c):
+        remove_command(c)
+        entry = metrics.queued.pop(id(c), None)
+        if entry is None:
+            return
+        ticks, start, attempts = entry
+        metrics.observe('op.retries', max(attempts - 1, 0))
+        blocked_ticks, blocked_ns = metrics.blocked.get(c.id_trans, (0, 0))
+        metrics.blocked[c.id_trans] = (blocked_ticks + manager.ticks - ticks,
+                                      blocked_ns + time.perf_counter_ns() - start)
+
+    manager._rmcommand = removed
+
+
+# Count commits and aborts by reason, with the time each transaction spent with operations queued
+def _instrument_transactions(manager, metrics):
+    def finished(id_trans):
+        blocked_ticks, blocked_ns = metrics.blocked.pop(id_trans, (0, 0))
+        metrics.observe('transaction.blocked_ticks', blocked_ticks)
+        metrics.time('transaction.blocked', blocked_ns)
+
+    commit = manager.commit
+
+    def committed(id_trans):
+        commit(id_trans)
+        metrics.counters['transaction.commits'] += 1
+        finished(id_trans)
+
+    manager.commit = committed
+
+    abort = manager.abort
+
+    def aborted(id_trans, reason=None):
+        abort(id_trans, reason)
+        metrics.counters[f'transaction.aborts.{reason}'] += 1
+        finished(id_trans)
+
+    manager.abort = aborted
+
+
+# Record how long each deadlock or timeout victim waited before it was aborted
+def _instrument_deadlock_aborts(manager, metrics):
+    break_deadlock = manager._break_deadlock
+
+    def broken(id_trans, reason):
+        waited = break_deadlock(id_trans, reason)
+        metrics.observe(f'{reason}.waited_ticks', waited)
+        return waited
+
+    manager._break_deadlock = broken
+
+
+# Time every operation, track the queue length and write periodic snapshots
+def _instrument_operations(manager, metrics):
+    next_operation = manager.getNextOperation
+
+    @functools.wraps(next_operation)
+    def timed(line):
+        start = time.perf_counter_ns()
+        if metrics.profiler is not None:
+            metrics.profiler.enable()
+        try:
+            return next_operation(line)
+        finally:
+            if metrics.profiler is not None:
+                metrics.profiler.disable()
+            metrics.time('operation', time.perf_counter_ns() - start)
+            metrics.queue_length = len(manager.commands)
+            metrics.observe('queue_length', metrics.queue_length)
+            if metrics.every > 0 and manager.ticks % metrics.every == 0:
+                metrics.write_snapshot()
+
+    manager.getNextOperation = timed
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics', type=str, help='append engine metrics as JSON lines to this file')
+    parser.add_argument('--metrics-every', type=int, default=0,
+                        help='also write metrics every this many ticks, 0 for only at the end')
+    parser.add_argument('--profile', type=str, help='profile every operation with cProfile and write the stats here')
+
+
+# Metrics from parsed arguments, None unless --metrics or --profile is given
+def metrics_from_args(args):
+    if args.metrics is None and args.profile is None:
+        return None
+    return Metrics(args.metrics, args.metrics_every, args.profile)
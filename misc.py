@@ -9,29 +9,62 @@ def get_down_sites(sites):
     return down_sites
 
 
-def node_in_cycle(start_node, graph):
-
-    # implemnts DFS
-    # https://stackoverflow.com/questions/43430309/depth-first-search-dfs-code-in-python
-    def path_to_start(graph, node, seen):
-
-        seen.append(node)
-        # print('seen', node, seen, graph[node])
-        for n in graph[node]:
-            if n == start_node:
-                return True
-            if n not in seen:
-                return path_to_start(graph, n, seen)
-        return False
-
-    res = path_to_start(graph, start_node, [])
-    # print('DONE', start_node, res, graph)
-    # print(res)
-    return res
-
-
-# Utility to check if variable is replicated beyond this site
-def is_replicated_variable(variable):
-    if int(variable[1:]) % 2 == 0:
-        return True
-    return False
+def strongly_connected_components(graph):
+
+    # iterative Tarjan, a single O(V+E) pass over graph (node -> iterable of successors)
+    # https://en.wikipedia.org/wiki/Tarjan%27s_strongly_connected_components_algorithm
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    components = []
+    counter = 0
+
+    for root in list(graph):
+        if root in index:
+            continue
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(graph.get(root, ())))]
+        while work:
+            node, successors = work[-1]
+            advanced = False
+            for n in successors:
+                if n not in index:
+                    index[n] = lowlink[n] = counter
+                    counter += 1
+                    stack.append(n)
+                    on_stack.add(n)
+                    work.append((n, iter(graph.get(n, ()))))
+                    advanced = True
+                    break
+                if n in on_stack:
+                    lowlink[node] = min(lowlink[node], index[n])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    n = stack.pop()
+                    on_stack.discard(n)
+                    component.append(n)
+                    if n == node:
+                        break
+                components.append(component)
+
+    return components
+
+
+def find_cycles(graph):
+    # components of graph that contain at least one cycle
+    cycles = []
+    for component in strongly_connected_components(graph):
+        if len(component) > 1 or component[0] in graph.get(component[0], ()):
+            cycles.append(component)
+    return cycles
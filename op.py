@@ -1,12 +1,17 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 READ = "READ"
 WRITE = "WRITE"
 
 
-@dataclass
+# Compared and hashed by identity, so the same operation can be found in the queue and the wait registry
+@dataclass(slots=True, eq=False)
 class Operation:
     op: str
     id_trans: str
     id_val: str
     value: str = ''
+    # tick the operation was queued at
+    queued_at: int = field(default=0, repr=False)
+    # set by the wait registry when a lock or site this operation waits on changes
+    ready: bool = field(default=True, repr=False)
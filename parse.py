@@ -1,18 +1,157 @@
 import re
+import sys
+from dataclasses import dataclass, field
+from typing import Any, List
 
 VALID_COMMANDS = ['begin', 'beginRO', 'R',  'W',
                   'fail', 'recover',  'dump', 'end', ]
 
+# argument names of each command, in order
+COMMAND_ARGS = {
+    'begin': ('id_trans',),
+    'beginRO': ('id_trans',),
+    'end': ('id_trans',),
+    'R': ('id_trans', 'id_val'),
+    'W': ('id_trans', 'id_val', 'value'),
+    'fail': ('site_id',),
+    'recover': ('site_id',),
+    'dump': (),
+}
 
-def parse(line: str):
+# name(arguments) followed by an optional // comment
+LINE_RE = re.compile(r'\s*(\w+)\s*\(([^()]*)\)\s*(?://.*)?')
+COMMENT_RE = re.compile(r'\s*//')
+# a written value that is stored as an integer
+INT_RE = re.compile(r'-?\d+')
 
-    line = line.replace(" ", "")  # remove any white space
-    res = re.split(r'[^\w]', line)  # split at special chars
-    res = res[:-1]  # remvoe empty string
-    if len(res) == 0:
-        return None
-    cur_command = res[0]
-    if cur_command not in VALID_COMMANDS:
-        raise ValueError(f"unknown command: {cur_command}, must be in {VALID_COMMANDS}")
 
-    return res
+class ParseError(ValueError):
+    def __init__(self, message, line_no=None):
+        super().__init__(message if line_no is None else f'line {line_no}: {message}')
+        self.line_no = line_no
+
+
+@dataclass(slots=True)
+class Command:
+    op: str
+    line_no: Any = None
+    id_trans: str = None
+    id_val: str = None
+    value: Any = None
+    site_id: int = None
+    # interned integer id of id_val, -1 if the command has none. Transactions are only named by
+    # id_trans: their ids are released when they finish and may then name a later transaction.
+    var_no: int = -1
+    # raw argument strings as written
+    args: List = field(default_factory=list)
+
+    # The command as the list of tokens [op, arg, ...]
+    def tokens(self):
+        return [self.op] + (self.args if len(self.args) > 0 else [''])
+
+
+# Maps names to dense integer ids, interning the name strings so equal names are one object.
+# Released ids are handed out again, so the table only grows with the names in use. An id is
+# therefore only valid while its name is live: keep the name, not the id, of anything that may
+# outlive the release.
+class SymbolTable:
+    def __init__(self):
+        self.ids = dict()
+        self.names = []
+        # released ids, reused before new ones
+        self.free = []
+
+    def intern(self, name):
+        symbol = self.ids.get(name)
+        if symbol is None:
+            name = sys.intern(name)
+            if len(self.free) > 0:
+                symbol = self.free.pop()
+                self.names[symbol] = name
+            else:
+                symbol = len(self.names)
+                self.names.append(name)
+            self.ids[name] = symbol
+        return symbol
+
+    def name(self, symbol):
+        return self.names[symbol]
+
+    # Forget name, freeing its id for another name
+    def release(self, name):
+        symbol = self.ids.pop(name, None)
+        if symbol is not None:
+            self.names[symbol] = None
+            self.free.append(symbol)
+
+    # Names read back from a pickle are interned again
+    def __setstate__(self, state):
+        self.names = [sys.intern(name) if name is not None else None for name in state['names']]
+        self.ids = {name: symbol for symbol, name in enumerate(self.names) if name is not None}
+        self.free = state.get('free', [])
+
+
+# Turns lines of the begin/beginRO/R/W/end/fail/recover/dump grammar into Commands in a single pass.
+class Parser:
+    def __init__(self):
+        self.transactions = SymbolTable()
+        self.variables = SymbolTable()
+
+    # Parse one line. Returns None for a blank line.
+    def parse_line(self, line, line_no=None):
+        match = LINE_RE.fullmatch(line)
+        if match is None:
+            if line.strip() == '':
+                return None
+            raise ParseError(f"can not parse: {line.strip()}", line_no)
+        op, arguments = match.groups()
+        arg_names = COMMAND_ARGS.get(op)
+        if arg_names is None:
+            raise ParseError(f"unknown command: {op}, must be in {VALID_COMMANDS}", line_no)
+        args = [arg.strip() for arg in arguments.split(',')] if arguments.strip() != '' else []
+        if len(args) != len(arg_names):
+            raise ParseError(f"{op} takes {len(arg_names)} arguments, got {len(args)}", line_no)
+
+        command = Command(op, line_no, args=args)
+        for name, arg in zip(arg_names, args):
+            if name == 'id_trans':
+                command.id_trans = self.transactions.name(self.transactions.intern(arg))
+            elif name == 'id_val':
+                command.var_no = self.variables.intern(arg)
+                command.id_val = self.variables.name(command.var_no)
+            elif name == 'value':
+                command.value = int(arg) if INT_RE.fullmatch(arg) else arg
+            elif name == 'site_id':
+                if not arg.isdigit():
+                    raise ParseError(f"site id must be a number, got {arg}", line_no)
+                command.site_id = int(arg)
+        return command
+
+    # Parse lines lazily, numbering them from 1. Comment lines are skipped and blank lines give None.
+    def parse_lines(self, lines):
+        for line_no, line in enumerate(lines, 1):
+            if is_comment(line):
+                continue
+            yield self.parse_line(line.rstrip('\r\n'), line_no)
+
+    # Parse a whole buffer at once
+    def parse_text(self, text):
+        return list(self.parse_lines(text.splitlines()))
+
+    # Parse a whole file at once
+    def parse_file(self, path):
+        with open(path, 'r') as f:
+            return list(self.parse_lines(f))
+
+
+# Whether line holds only a // comment
+def is_comment(line):
+    return COMMENT_RE.match(line) is not None
+
+
+# Parse a single line into its list of tokens, None for a blank line
+def parse(line: str):
+    command = Parser().parse_line(line)
+    if command is None:
+        return None
+    return command.tokens()
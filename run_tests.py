@@ -0,0 +1,123 @@
+import argparse
+import difflib
+import functools
+import glob
+import os
+import re
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from events import RESULT, ListSink, format_event
+from manager_transaction import TransactionManager
+from site_log import LogSettings
+
+DEFAULT_EXPECTED_DIR = os.path.join('tests', 'expected')
+
+
+# Lines a result event contributes to a scenario's expected output
+def result_lines(event):
+    if event.kind == 'read':
+        return [f"{event.fields['id_trans']}: {event.fields['value']}"]
+    if event.kind == 'dump':
+        return format_event(event).splitlines()[1:]
+    return [format_event(event)]
+
+
+# Run one scenario file against a fresh TransactionManager. Returns its path, result lines,
+# run time in seconds and the error traceback if it crashed.
+def run_scenario(path, site_workers=0, durable=False, checkpoint_every=None):
+    with tempfile.TemporaryDirectory() as log_dir:
+        durability = None
+        if durable:
+            durability = LogSettings(log_dir)
+            if checkpoint_every is not None:
+                durability.checkpoint_every = checkpoint_every
+        sink = ListSink(level=RESULT)
+        manager = TransactionManager(sink=sink, site_workers=site_workers, durability=durability)
+        error = None
+        start = time.perf_counter()
+        try:
+            for command in manager.parser.parse_file(path):
+                manager.getNextOperation(command)
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            manager.close()
+        elapsed = time.perf_counter() - start
+    results = [line for event in sink.events for line in result_lines(event)]
+    return path, results, elapsed, error
+
+
+def expected_path(path, expected_dir):
+    return os.path.join(expected_dir, os.path.basename(path))
+
+
+def scenario_files(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.txt')
+        paths.extend(sorted(glob.glob(pattern)))
+    # natural order, so test2 runs before test10
+    return sorted(set(paths), key=lambda p: [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', p)])
+
+
+def main(args):
+    paths = scenario_files(args.scenarios)
+    if len(paths) == 0:
+        print('no scenarios found')
+        return 1
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        scenario = functools.partial(run_scenario, site_workers=args.site_workers, durable=args.durable,
+                                     checkpoint_every=args.checkpoint_every)
+        for path, results, elapsed, error in pool.map(scenario, paths, chunksize=args.chunksize):
+            golden = expected_path(path, args.expected)
+            if error is not None:
+                status = 'ERROR'
+            elif args.update:
+                os.makedirs(args.expected, exist_ok=True)
+                with open(golden, 'w') as f:
+                    f.write(''.join(line + '\n' for line in results))
+                status = 'UPDATED'
+            elif not os.path.exists(golden):
+                status = 'MISSING'
+            else:
+                with open(golden, 'r') as f:
+                    expected = f.read().splitlines()
+                status = 'PASS' if expected == results else 'FAIL'
+
+            if status in ['ERROR', 'MISSING', 'FAIL']:
+                failed += 1
+            if status != 'PASS' or not args.quiet:
+                print(f'{status:8} {path} ({1000 * elapsed:.1f} ms)')
+            if status == 'ERROR':
+                print(error)
+            elif status == 'FAIL':
+                sys.stdout.writelines(difflib.unified_diff(
+                    [line + '\n' for line in expected], [line + '\n' for line in results], golden, path))
+
+    print(f'{len(paths) - failed} passed, {failed} failed')
+    return 1 if failed > 0 else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='run scenario files in parallel and compare results with expected outputs')
+
+    parser.add_argument('scenarios', nargs='*', default=['tests'], help='scenario files, globs or directories')
+    parser.add_argument('-e', '--expected', type=str, default=DEFAULT_EXPECTED_DIR, help='directory of expected outputs')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes, defaults to the cpu count')
+    parser.add_argument('--chunksize', type=int, default=8, help='scenarios handed to a worker at a time')
+    parser.add_argument('--site-workers', type=int, default=0, help='run each scenario with its sites in worker processes')
+    parser.add_argument('--durable', action='store_true', help='give each scenario durable site logs in a temporary directory')
+    parser.add_argument('--checkpoint-every', type=int, help='log records between checkpoints with --durable')
+    parser.add_argument('-u', '--update', action='store_true', help='write current results as the expected outputs')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only report scenarios that do not pass')
+
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import json
+
+from events import LEVELS, RESULT, EventSink, format_event
+from manager_transaction import TransactionManager, add_deadlock_arguments, deadlock_options_from_args
+from parse import ParseError, is_comment
+from site_log import add_log_arguments, log_settings_from_args
+from site_worker import add_site_worker_arguments
+from topology import add_topology_arguments, placement_from_args
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 7777
+
+
+# One connection. Lines are queued for writing and flushed by the connection's handler.
+class Client:
+    def __init__(self, writer, as_json=False):
+        self.writer = writer
+        self.as_json = as_json
+
+    def send(self, text):
+        if not self.writer.is_closing():
+            self.writer.write((text + '\n').encode())
+
+    def send_event(self, event):
+        if self.as_json:
+            record = {'kind': event.kind, 'tick': event.tick}
+            record.update(event.fields)
+            self.send(json.dumps(record, default=str))
+        else:
+            self.send(format_event(event))
+
+
+# Sends each event to the client owning its transaction, or to the client whose
+# operation is running when the event has no transaction.
+class RoutingSink(EventSink):
+    def __init__(self, server, level=RESULT):
+        self.server = server
+        self.level = level
+
+    def emit(self, event):
+        id_trans = event.fields.get('id_trans')
+        client = self.server.owners.get(id_trans, self.server.current)
+        if client is not None:
+            client.send_event(event)
+        if event.kind in ['commit', 'abort']:
+            self.server.owners.pop(id_trans, None)
+
+
+# Line protocol front end for a single TransactionManager. Every client line is one operation in
+# the begin/beginRO/R/W/end/fail/recover/dump grammar. Operations from all clients go through one
+# queue and run one tick at a time. A client gets the events of its transactions and then 'ok' once
+# its operation has run, or 'error: ...'. While the operation is blocked the client waits for it,
+# but other clients keep going.
+class TransactionServer:
+    def __init__(self, manager=None, level=RESULT, as_json=False):
+        self.manager = manager if manager is not None else TransactionManager()
+        self.manager.sink = RoutingSink(self, level)
+        self.as_json = as_json
+        self.queue = asyncio.Queue()
+        # id_trans -> client that issued its operations
+        self.owners = dict()
+        # id_trans -> future of its blocked operation
+        self.waiting = dict()
+        # client whose operation is running
+        self.current = None
+
+    async def handle_client(self, reader, writer):
+        client = Client(writer, self.as_json)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                text = line.decode().strip()
+                if text == '' or is_comment(text):
+                    continue
+                try:
+                    command = self.manager.parser.parse_line(text)
+                except ParseError as e:
+                    client.send(f'error: {e}')
+                    await writer.drain()
+                    continue
+                done = loop.create_future()
+                await self.queue.put((client, command, done))
+                await done
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # Run queued operations one tick at a time
+    async def run_ticks(self):
+        while True:
+            client, command, done = await self.queue.get()
+            self.current = client
+            if command.id_trans is not None:
+                self.owners[command.id_trans] = client
+            try:
+                self.manager.getNextOperation(command)
+            except Exception as e:
+                client.send(f'error: {e!r}')
+                done.set_result(None)
+                continue
+            finally:
+                self.current = None
+
+            blocked = {cmd.id_trans for cmd in self.manager.commands}
+            if command.id_trans in blocked and command.op in ['R', 'W']:
+                self.waiting[command.id_trans] = (client, done)
+            else:
+                client.send('ok')
+                done.set_result(None)
+            self._release(blocked)
+
+            # nothing new to run while clients wait: their operations may be deadlocked, so keep ticking
+            # until the deadlock handling has seen them, a client is answered or a new operation arrives
+            for _ in range(self.manager.idle_ticks()):
+                if not self.queue.empty() or len(self.waiting) == 0:
+                    break
+                self.manager.idle()
+                self._release({cmd.id_trans for cmd in self.manager.commands})
+                await asyncio.sleep(0)
+
+    # Answer the clients whose blocked operation is no longer queued
+    def _release(self, blocked):
+        for id_trans in list(self.waiting):
+            if id_trans not in blocked:
+                client, done = self.waiting.pop(id_trans)
+                client.send('ok')
+                done.set_result(None)
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        ticker = asyncio.create_task(self.run_ticks())
+        server = await asyncio.start_server(self.handle_client, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            ticker.cancel()
+
+
+def main(args):
+    manager = TransactionManager(args.sites, args.variables, placement_from_args(args), site_workers=args.site_workers,
+                                 durability=log_settings_from_args(args), **deadlock_options_from_args(args))
+    server = TransactionServer(manager, LEVELS[args.level], args.json)
+    print(f'listening on {args.host}:{args.port}')
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    finally:
+        manager.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='serve one transaction manager to many clients over a line protocol')
+
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST, help='address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on')
+    parser.add_argument('--level', type=str, default='result', choices=list(LEVELS),
+                        help='least important events sent to clients')
+    parser.add_argument('--json', action='store_true', help='send events as JSON lines instead of text')
+    add_topology_arguments(parser)
+    add_site_worker_arguments(parser)
+    add_deadlock_arguments(parser)
+    add_log_arguments(parser)
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,189 @@
+import json
+import mmap
+import os
+from dataclasses import dataclass, field
+from typing import List
+
+from version_store import SiteVersions, VersionStore
+
+# log records between fsyncs of a site's log
+DEFAULT_SYNC_EVERY = 64
+# log records between checkpoints, bounding how much a recovery replays
+DEFAULT_CHECKPOINT_EVERY = 1024
+
+
+# Where site logs are kept and how often they are synced and checkpointed
+@dataclass
+class LogSettings:
+    directory: str
+    sync_every: int = DEFAULT_SYNC_EVERY
+    checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY
+
+    def open(self, site_id):
+        return SiteLog(self.directory, site_id, self.sync_every, self.checkpoint_every)
+
+
+# Durable state of a site as rebuilt from its checkpoint and log
+@dataclass
+class DurableState:
+    data: SiteVersions
+    up_times: List = field(default_factory=list)
+    start_time: int = 0
+    up: bool = True
+    # timestamp of the latest record
+    last_time: int = 0
+
+
+# Records of a JSON lines file, read through a memory map, and the size of its intact prefix.
+# A partially written last line is ignored.
+def _read_records(path):
+    records = []
+    size = 0
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return records, size
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for line in iter(mm.readline, b''):
+            if not line.endswith(b'\n'):
+                break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            size += len(line)
+    return records, size
+
+
+# Apply one log record to state
+def _replay(state, record):
+    state.last_time = record['t']
+    if record['op'] == 'commit':
+        for variable, value in record['w'].items():
+            state.data[variable].append(value, record['t'])
+            state.data[variable].prune(record['h'])
+    elif record['op'] == 'fail':
+        state.up = False
+        state.up_times.append((state.start_time, record['t']))
+    elif record['op'] == 'recover':
+        state.up = True
+        state.start_time = record['t']
+
+
+# Append-only log of a site's commits, failures and recoveries with periodic checkpoints of its
+# committed versions. Each record is handed to the OS in a single write, so it survives the process;
+# fsyncs are grouped every sync_every records. Every checkpoint_every records the committed versions
+# are written to a new checkpoint and the log restarts, so recovery replays at most that many records.
+class SiteLog:
+    def __init__(self, directory, site_id, sync_every=DEFAULT_SYNC_EVERY, checkpoint_every=DEFAULT_CHECKPOINT_EVERY):
+        os.makedirs(directory, exist_ok=True)
+        self.site_id = site_id
+        self.log_path = os.path.join(directory, f'site{site_id}.log')
+        self.checkpoint_path = os.path.join(directory, f'site{site_id}.ckpt')
+        self.sync_every = sync_every
+        self.checkpoint_every = checkpoint_every
+        # sequence number of the last record
+        self.lsn = 0
+        # timestamp of the last record
+        self.last_time = 0
+        # records written since the last fsync and since the last checkpoint
+        self.unsynced = 0
+        self.since_checkpoint = 0
+        self.file = None
+
+    # Rebuild the durable state from the latest checkpoint and the log records after it
+    def load(self, topology):
+        state = DurableState(SiteVersions(self.site_id, topology))
+        lsn = 0
+        checkpoint, _ = _read_records(self.checkpoint_path)
+        if len(checkpoint) > 0:
+            header = checkpoint[0]
+            lsn = header['lsn']
+            state.up_times = [tuple(up_time) for up_time in header['up_times']]
+            state.start_time = header['start_time']
+            state.up = header['up']
+            state.last_time = header['last_time']
+            for variable, values, commit_times in checkpoint[1:]:
+                state.data[variable] = VersionStore.from_columns(values, commit_times)
+        records, size = _read_records(self.log_path)
+        for record in records:
+            if record['lsn'] > lsn:
+                _replay(state, record)
+                lsn = record['lsn']
+        return state, lsn, size
+
+    # Load the durable state and open the log for appending after its last intact record
+    def restore(self, topology):
+        state, self.lsn, size = self.load(topology)
+        self.last_time = state.last_time
+        self.file = open(self.log_path, 'a')
+        # drop a torn record left by a crash mid-write
+        self.file.truncate(size)
+        self.since_checkpoint = 0
+        return state
+
+    def _append(self, record):
+        self.lsn += 1
+        self.last_time = record['t']
+        self.file.write(json.dumps(dict(lsn=self.lsn, **record), separators=(',', ':')) + '\n')
+        self.file.flush()
+        self.unsynced += 1
+        self.since_checkpoint += 1
+        if self.sync_every > 0 and self.unsynced >= self.sync_every:
+            self.sync()
+
+    def log_commit(self, commit_time, writes, horizon=None):
+        self._append({'t': commit_time, 'op': 'commit', 'w': writes, 'h': horizon})
+
+    def log_fail(self, timestamp):
+        self._append({'t': timestamp, 'op': 'fail'})
+        self.sync()
+
+    def log_recover(self, timestamp):
+        self._append({'t': timestamp, 'op': 'recover'})
+
+    def needs_checkpoint(self):
+        return self.checkpoint_every > 0 and self.since_checkpoint >= self.checkpoint_every
+
+    # Write the committed versions to a new checkpoint, replacing the old one atomically, and restart the log
+    def checkpoint(self, data, up_times, start_time, up):
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            header = {'lsn': self.lsn, 'up_times': up_times, 'start_time': start_time, 'up': up,
+                      'last_time': self.last_time}
+            lines = [json.dumps(header)]
+            for variable, versions in data.items():
+                lines.append(json.dumps([variable, list(versions.values), list(versions.commit_times)], separators=(',', ':')))
+            f.write('\n'.join(lines) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+        self.file.close()
+        self.file = open(self.log_path, 'w')
+        self.unsynced = 0
+        self.since_checkpoint = 0
+
+    def sync(self):
+        if self.unsynced > 0:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+def add_log_arguments(parser):
+    parser.add_argument('--log-dir', type=str,
+                        help='keep a durable log per site in this directory, restoring the sites from it if it exists')
+    parser.add_argument('--sync-every', type=int, default=DEFAULT_SYNC_EVERY,
+                        help='log records between fsyncs, 0 to leave syncing to the OS')
+    parser.add_argument('--checkpoint-every', type=int, default=DEFAULT_CHECKPOINT_EVERY,
+                        help='log records between checkpoints, 0 to never checkpoint')
+
+
+# LogSettings from parsed arguments, None without --log-dir
+def log_settings_from_args(args):
+    if args.log_dir is None:
+        return None
+    return LogSettings(args.log_dir, args.sync_every, args.checkpoint_every)
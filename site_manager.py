@@ -1,18 +1,23 @@
+from bisect import bisect_right
+from operator import itemgetter
+
 from lock import Lock
 from lock_type import LockType
 from locktable import LockTable
-from misc import *
-from op import *
+from topology import Topology
 from transaction import Transaction, TransType
+from version_store import SiteVersions
 
 
 # Represents a site
 class SiteManager:
-    def __init__(self, site_id):
+    def __init__(self, site_id, wait_registry=None, waits_for_graph=None, topology=None, log=None):
 
-        # maintains a dictionary for locks on all variables
-        self.lock_table = LockTable()
-        # list of tuples of (up_timestamp, down_timestamp) for site
+        # maintains a dictionary for locks on all variables, feeding its waits-for edges into waits_for_graph
+        self.lock_table = LockTable(site_id, wait_registry, waits_for_graph)
+        # registry of operations blocked on this site, woken when its state changes
+        self.wait_registry = wait_registry
+        # list of tuples of (up_timestamp, down_timestamp) for site, in time order and disjoint
         self.up_times = []
         # start timestamp of current up_time
         self.start_time = 0
@@ -20,68 +25,126 @@ class SiteManager:
         self.can_commit = True
         # site id
         self.site_id = site_id
+        # number of sites and variables and which variables this site stores
+        self.topology = topology if topology is not None else Topology()
         # site is up or down
         self.up = True
-        # temporary workspace before committing. values are list of tuples of (value, transaction_id)
+        # temporary workspace before committing. write set per transaction: transaction_id -> {variable: value}
         self.tempData = dict()
-        # committed data stored in the site. values are list of tuples of (committed_value, commit_time)
+        # committed data stored in the site. values are VersionStores of (committed_value, commit_time)
         self.data = dict()
+        # variables holding more than one committed version, candidates for garbage collection
+        self.multi_version_variables = set()
+        # durable log of commits, failures and recoveries. Without one committed data only lives in memory
+        self.log = log
 
         self._initialize_database()
 
-    # initialize variables and data
+    # initialize variables and data. Versions of a variable are only created when it is first used,
+    # so sites start in constant time whatever the number of variables.
     def _initialize_database(self):
-        current_timestamp = 0
-        for i in range(0, 20):
-            if (i + 1) % 2 != 0:  # not even
-                # not replicated
-                # variable = 'xn' + str(i)
-                variable = 'x' + str(i+1)
-                if (i + 1) % 10 + 1 == self.site_id:
-                    self.data[variable] = [((i + 1) * 10, current_timestamp)]
-            else:
-                # replicated
-                # variable = 'xr' + str(i)
-                variable = 'x' + str(i + 1)
-                self.data[variable] = [((i + 1) * 10, current_timestamp)]
+        if self.log is not None:
+            self._load_state(self.log.restore(self.topology))
+        else:
+            self.data = SiteVersions(self.site_id, self.topology)
+
+    # Take over the durable state rebuilt from the log. A down site keeps no data in memory.
+    def _load_state(self, state):
+        self.up = state.up
+        self.up_times = list(state.up_times)
+        self.start_time = state.start_time
+        self.data = state.data if state.up else None
+        self.multi_version_variables = set()
+        if self.data is not None:
+            self.multi_version_variables = {variable for variable, versions in self.data.items() if len(versions) > 1}
+
+    # Timestamp of the latest durable record of this site, 0 without a log
+    def last_logged_time(self):
+        return self.log.last_time if self.log is not None else 0
 
     # Fail this site
     def fail(self, timestamp):
         self.up = False
         self.up_times.append((self.start_time, timestamp))
         self.lock_table.clear()
+        if self.log is not None:
+            # memory is lost, only what the log holds survives
+            self.log.log_fail(timestamp)
+            self.data = None
+            self.multi_version_variables = set()
+            self.tempData = dict()
+        # Locks held here are gone, writes may now proceed on the remaining sites
+        self._notify_site()
 
     # Site recovers
     def recover(self, timestamp):
         # No variable from this site is now readable until written to
         self.up = True
         self.start_time = timestamp
+        if self.log is not None:
+            # rebuild the committed data from the latest checkpoint and the log tail
+            self.log.log_recover(timestamp)
+            state, _, _ = self.log.load(self.topology)
+            self._load_state(state)
+        self._notify_site()
+
+    # Wake every operation waiting on this site
+    def _notify_site(self):
+        if self.wait_registry is not None:
+            self.wait_registry.notify_site(self.site_id)
+
+    # Wake operations waiting on variable at this site
+    def _notify(self, variable):
+        if self.wait_registry is not None:
+            self.wait_registry.notify(self.site_id, variable)
 
     # For deadlock detection per site
     def get_dep_graph(self):
         return self.lock_table.get_dep_graph()
 
+    # Transactions transaction_id waits for on the lock on variable, as owners or earlier conflicting requests
+    def blockers(self, transaction_id, variable):
+        return {blocker for waiter, blocker in self.lock_table.variable_edges.get(variable, ()) if waiter == transaction_id}
+
     # Abort given transaction
     def abort(self, transaction_id):
         self.lock_table.unlock_tid_queue(transaction_id)
         self.lock_table.release_locks_by_transaction(transaction_id)
         self.lock_table.dequeue_waiting_locks()
+        # discard uncommitted writes
+        self.tempData.pop(transaction_id, None)
 
-    # Perform commit at commit_time
-    def commit(self, transaction_id, commit_time, transaction=None):
+    # Perform commit at commit_time. Versions no read-only snapshot at or after horizon can
+    # read are dropped from the committed variables.
+    def commit(self, transaction_id, commit_time, horizon=None):
 
         # if transaction is not None:
         #     if transaction.id_trans == transaction_id:
 
         self.lock_table.release_locks_by_transaction(transaction_id)
 
-        for variable in self.tempData.copy():
-            if self.tempData[variable][1] == transaction_id:
-                self.data[variable].append((self.tempData[variable][0], commit_time))
-                del self.tempData[variable]
+        writes = self.tempData.pop(transaction_id, {})
+        for variable, value in writes.items():
+            self.data[variable].append(value, commit_time)
+            self.data[variable].prune(horizon)
+            if len(self.data[variable]) > 1:
+                self.multi_version_variables.add(variable)
+            # A fresh commit makes the variable readable again after recovery
+            self._notify(variable)
+        if self.log is not None and len(writes) > 0:
+            self.log.log_commit(commit_time, writes, horizon)
+            if self.log.needs_checkpoint():
+                self.log.checkpoint(self.data, self.up_times, self.start_time, self.up)
 
         self.lock_table.dequeue_waiting_locks()
 
+    # Drop versions no read-only snapshot at or after horizon can read
+    def collect_garbage(self, horizon=None):
+        for variable in list(self.multi_version_variables):
+            self.data[variable].prune(horizon)
+            if len(self.data[variable]) == 1:
+                self.multi_version_variables.discard(variable)
+
     # Calls appropriate read function based on whether transaction is RO or RW
     def read(self, variable, transaction):
         if transaction.transactionType == TransType.READ_ONLY:
@@ -90,33 +153,31 @@ class SiteManager:
 
     # Read method for read-only transactions.
     def ro_read(self, variable, transaction_id, timestamp):
-        committed_values = self.data[variable]
-        for val_tuple in reversed(committed_values):
-            if val_tuple[1] > timestamp:
-                continue
-            # val_tuple has last committed value before the transaction began
-            if is_replicated_variable(variable):
-                # variable is replicated
-                if val_tuple[1] < timestamp and val_tuple[1] >= self.start_time:
-                    # For current running span of site
-                    # if last commit was between site start_time and start of RO transaction
-                    return (val_tuple[0],0)
-                # If not in current running span, check in previous up times
-                for up_time in reversed(self.up_times):
-                    if val_tuple[1] < timestamp and val_tuple[1] >= up_time[0] and timestamp < up_time[1]:
-                        return (val_tuple[0],0)
-                # This site does not have any usable committed value
+        val_tuple = self.data[variable].find(timestamp)
+        if val_tuple is None:
+            # No committed value before RO transaction began
+            return (None,0)
+        # val_tuple has last committed value before the transaction began
+        if self.topology.is_replicated(variable):
+            # variable is replicated, readable if the site stayed up from the commit to the start of the transaction
+            commit_time = val_tuple[1]
+            if commit_time >= timestamp:
                 return (None,0)
-            else:
-                # variable is not replicated
+            if commit_time >= self.start_time:
+                # For current running span of site
+                # if last commit was between site start_time and start of RO transaction
                 return (val_tuple[0],0)
-
-        # No committed value before RO transaction began
-        return (None,0)
+            # If not in current running span, only the last previous up time starting by the commit can hold it
+            i = bisect_right(self.up_times, commit_time, key=itemgetter(0)) - 1
+            if i >= 0 and timestamp < self.up_times[i][1]:
+                return (val_tuple[0],0)
+            # This site does not have any usable committed value
+            return (None,0)
+        # variable is not replicated
+        return (val_tuple[0],0)
 
     # Read method for read-write transactions.
     def rw_read(self, variable, transaction_id):
-        committed_values = self.data[variable]
 
         # res = self.data[variable][-1][0]
         # if is_replicated_variable(variable):
@@ -128,13 +189,13 @@ class SiteManager:
         # Site is up but its last committed value was before recovery
         read_val = None
         to_enqueue = False
-        if is_replicated_variable(variable) and self.data[variable][-1][1] < self.start_time:
+        if self.topology.is_replicated(variable) and self.data[variable].latest_time() < self.start_time:
             return (read_val, to_enqueue)
         else:
             if self.lock_table.is_locked(variable):
                 if self.lock_table.is_read_locked(variable):
                     if transaction_id in self.lock_table.get_lock_owners(variable):
-                        read_val = self.data[variable][-1][0]
+                        read_val = self.data[variable].latest_value()
                     else:
                         # read lock is held by some other transaction
                         if self.lock_table.has_waiting_write_lock(variable):
@@ -142,10 +203,12 @@ class SiteManager:
                             to_enqueue = True
                         else:
                             self.lock_table.share_lock(transaction_id, variable)
-                            read_val = self.data[variable][-1][0]
+                            read_val = self.data[variable].latest_value()
                 else:
                     if transaction_id in self.lock_table.get_lock_owners(variable):
-                        read_val = self.tempData[variable][0]
+                        # read own uncommitted write, if it was already made at this site
+                        read_val = self.tempData.get(transaction_id, {}).get(
+                            variable, self.data[variable].latest_value())
                     else:
                         to_enqueue = True
                 if to_enqueue:
@@ -154,7 +217,7 @@ class SiteManager:
             else:
                 # If there's no lock on the variable, set a read lock before reading and return read value.
                 self.lock_table.lock(transaction_id, variable, LockType.RLOCK)
-                read_val = self.data[variable][-1][0]
+                read_val = self.data[variable].latest_value()
         return (read_val,to_enqueue)
 
     # To check whether a transaction can get the write lock of the variable.
@@ -198,11 +261,15 @@ class SiteManager:
         else:
             # Current variable is not locked
             self.lock_table.lock(transaction_id, variable, LockType.WLOCK)
-        self.tempData[variable] = (value, transaction_id)
+        self.tempData.setdefault(transaction_id, {})[variable] = value
 
-    # dump the store
+    # dump the store: latest committed value of every variable at this site
     def dump(self):
-        o_str = f'site_id {self.site_id} up: {self.up}'
-        strs = [f'{k}:{v[-1][0]}' for k, v in self.data.items()]
-        o_str = f'{o_str} — {", ".join(strs)}'
-        print(o_str)
+        data = self.data if self.data is not None else self.log.load(self.topology)[0].data
+        values = {k: data.latest_value(k) for k in data.variables()}
+        return {'site_id': self.site_id, 'up': self.up, 'values': values}
+
+    # Sync and close the log
+    def close(self):
+        if self.log is not None:
+            self.log.close()
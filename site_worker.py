@@ -0,0 +1,329 @@
+import multiprocessing
+
+from site_manager import SiteManager
+from transaction import TransType
+from version_store import SiteVersions
+from waits_for_graph import WaitsForGraph
+
+
+# Stands in for the wait registry and the global waits-for graph inside a worker process. It records
+# the notifications and edge changes of the worker's sites so the manager can replay them on its own.
+class ChangeLog:
+    def __init__(self):
+        self.changes = []
+
+    def notify(self, site_id, variable):
+        self.changes.append(('notify', site_id, variable))
+
+    def notify_site(self, site_id):
+        self.changes.append(('notify_site', site_id))
+
+    def add_edges(self, edges):
+        if len(edges) > 0:
+            self.changes.append(('add_edges', edges))
+
+    def remove_edges(self, edges):
+        if len(edges) > 0:
+            self.changes.append(('remove_edges', edges))
+
+    # Changes recorded since the last call
+    def drain(self):
+        changes = self.changes
+        self.changes = []
+        return changes
+
+
+# Build a SiteManager for site_id from the state kept in its stable storage, which is its durable
+# log when versions is None
+def _load_site(site_id, topology, log, durability, versions, up_times, start_time):
+    if versions is None:
+        return SiteManager(site_id, log, log, topology, durability.open(site_id))
+    site = SiteManager(site_id, log, log, topology)
+    site.data.update(versions)
+    site.multi_version_variables = {variable for variable, store in versions.items() if len(store) > 1}
+    site.up_times = list(up_times)
+    site.start_time = start_time
+    return site
+
+
+# Main loop of a worker process. Every message is (site_id, method, args) and is answered with
+# (result, changes, error). None stops the worker.
+def _serve(conn, topology, durability):
+    log = ChangeLog()
+    sites = dict()
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        site_id, method, args = message
+        result = None
+        error = None
+        try:
+            if method == 'load':
+                site = _load_site(site_id, topology, log, durability, *args)
+                sites[site_id] = site
+                result = {'up': site.up, 'up_times': site.up_times, 'start_time': site.start_time,
+                          'last_time': site.last_logged_time()}
+            elif method == 'drop':
+                sites.pop(site_id).close()
+            elif method == 'commit':
+                # the committed writes go back to the manager's copy of stable storage
+                site = sites[site_id]
+                result = site.tempData.get(args[0], {})
+                site.commit(*args)
+            else:
+                result = getattr(sites[site_id], method)(*args)
+        except Exception as e:
+            error = e
+        conn.send((result, log.drain(), error))
+    for site in sites.values():
+        site.close()
+    conn.close()
+
+
+# A worker process hosting a shard of sites, reached over a pipe.
+class SiteWorker:
+    def __init__(self, topology, context=None, durability=None):
+        self.topology = topology
+        self.durability = durability
+        self.context = context if context is not None else multiprocessing.get_context()
+        self.process = None
+        self.conn = None
+        # ids of the sites loaded in the process
+        self.site_ids = set()
+
+    def running(self):
+        return self.process is not None
+
+    def start(self):
+        self.conn, child = self.context.Pipe()
+        self.process = self.context.Process(target=_serve, args=(child, self.topology, self.durability),
+                                            daemon=True)
+        self.process.start()
+        child.close()
+
+    # Load site_id into the process, starting it if needed. Returns the loaded site's up state,
+    # up_times, start_time and last_time.
+    def load(self, site_id, versions, up_times, start_time):
+        if not self.running():
+            self.start()
+        self.site_ids.add(site_id)
+        return self.call(site_id, 'load', versions, up_times, start_time)[0]
+
+    # Discard site_id and everything it kept in memory. The process is killed once it hosts no site.
+    def drop(self, site_id):
+        self.site_ids.discard(site_id)
+        if len(self.site_ids) == 0:
+            self.kill()
+        else:
+            self.call(site_id, 'drop')
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def send(self, site_id, method, *args):
+        self.conn.send((site_id, method, args))
+
+    # Next reply, in the order the requests were sent
+    def receive(self):
+        result, changes, error = self.conn.recv()
+        if error is not None:
+            raise error
+        return result, changes
+
+    def call(self, site_id, method, *args):
+        self.send(site_id, method, *args)
+        return self.receive()
+
+    def close(self):
+        if self.running():
+            self.conn.send(None)
+            self.process.join()
+            self.conn.close()
+            self.process = None
+            self.conn = None
+
+
+# Proxy with the interface of SiteManager for a site running in a SiteWorker. Lock notifications and
+# waits-for edge changes made by the site are applied to the manager's wait registry and graph. The
+# site's stable storage is its durable log if it has one, otherwise the proxy keeps a copy of the
+# committed versions. Either way a failure can kill the site's memory and recovery reloads it.
+class RemoteSite:
+    def __init__(self, site_id, worker, wait_registry, waits_for_graph, topology, durability=None):
+        self.site_id = site_id
+        self.worker = worker
+        self.wait_registry = wait_registry
+        self.waits_for_graph = waits_for_graph
+        self.topology = topology
+        self.durability = durability
+        self.up = True
+        self.start_time = 0
+        self.up_times = []
+        # committed versions of the site's variables, surviving failures, when there is no durable log
+        self.stable = SiteVersions(site_id, topology) if durability is None else None
+        # waits-for edges this site has added to the manager's graph
+        self.edges = WaitsForGraph()
+        # methods not yet received: (method, args, whether it went to the worker, result if it did not)
+        self.pending = []
+        self.last_time = 0
+        self._load()
+        if not self.up:
+            # the log ends with a failure
+            self.worker.drop(site_id)
+
+    # Load the site into its worker from stable storage
+    def _load(self):
+        versions = dict(self.stable) if self.stable is not None else None
+        loaded = self.worker.load(self.site_id, versions, self.up_times, self.start_time)
+        self.up = loaded['up']
+        self.up_times = list(loaded['up_times'])
+        self.start_time = loaded['start_time']
+        self.last_time = loaded['last_time']
+
+    # Timestamp of the latest durable record of the site when it was loaded
+    def last_logged_time(self):
+        return self.last_time
+
+    # Start method on the site without waiting for its result. A down site answers locally.
+    def send(self, method, *args):
+        if self.up:
+            self.worker.send(self.site_id, method, *args)
+            self.pending.append((method, args, True, None))
+        else:
+            self.pending.append((method, args, False, self._down_call(method, *args)))
+
+    # Result of the oldest method sent
+    def receive(self):
+        method, args, sent, result = self.pending.pop(0)
+        if not sent:
+            return result
+        result, changes = self.worker.receive()
+        self._apply(changes)
+        if method == 'commit' and self.stable is not None:
+            self._stable_commit(result, *args)
+        elif method == 'collect_garbage' and self.stable is not None:
+            self._stable_prune(*args)
+        return result
+
+    def call(self, method, *args):
+        self.send(method, *args)
+        return self.receive()
+
+    # What method does at a site whose memory is gone
+    def _down_call(self, method, *args):
+        if method == 'collect_garbage' and self.stable is not None:
+            self._stable_prune(*args)
+        elif method == 'dump':
+            return self._stable_dump()
+        return None
+
+    # Replay notifications and waits-for edge changes recorded at the site
+    def _apply(self, changes):
+        for change in changes:
+            kind = change[0]
+            if kind == 'notify':
+                self.wait_registry.notify(change[1], change[2])
+            elif kind == 'notify_site':
+                self.wait_registry.notify_site(change[1])
+            elif kind == 'add_edges':
+                self.waits_for_graph.add_edges(change[1])
+                self.edges.add_edges(change[1])
+            elif kind == 'remove_edges':
+                self.waits_for_graph.remove_edges(change[1])
+                self.edges.remove_edges(change[1])
+
+    def _stable_commit(self, writes, transaction_id, commit_time, horizon=None):
+        for variable, value in writes.items():
+            self.stable[variable].append(value, commit_time)
+            self.stable[variable].prune(horizon)
+
+    def _stable_prune(self, horizon=None):
+        for store in self.stable.values():
+            store.prune(horizon)
+
+    def _stable_dump(self):
+        stable = self.stable
+        if stable is None:
+            stable = self.durability.open(self.site_id).load(self.topology)[0].data
+        values = {k: stable.latest_value(k) for k in stable.variables()}
+        return {'site_id': self.site_id, 'up': self.up, 'values': values}
+
+    # Kill the site: its locks, uncommitted writes and waits-for edges are lost
+    def fail(self, timestamp):
+        if self.durability is not None:
+            # the site records its failure in its log first
+            self.call('fail', timestamp)
+        self.up = False
+        self.up_times.append((self.start_time, timestamp))
+        self.worker.drop(self.site_id)
+        edges = [(waiter, blocker) for waiter, blockers in self.edges.edges.items()
+                 for blocker, count in blockers.items() for _ in range(count)]
+        self.waits_for_graph.remove_edges(edges)
+        self.edges.clear()
+        self.wait_registry.notify_site(self.site_id)
+
+    # Restart the site from stable storage
+    def recover(self, timestamp):
+        self._load()
+        self.up = True
+        self.start_time = timestamp
+        self.call('recover', timestamp)
+
+    def read(self, variable, transaction):
+        if transaction.transactionType == TransType.READ_ONLY:
+            return self.call('ro_read', variable, transaction.id_trans, transaction.startTime)
+        return self.call('rw_read', variable, transaction.id_trans)
+
+    def test_write_lock(self, transaction_id, variable):
+        return self.call('test_write_lock', transaction_id, variable)
+
+    def blockers(self, transaction_id, variable):
+        return self.call('blockers', transaction_id, variable)
+
+    def write(self, transaction_id, variable, value):
+        return self.call('write', transaction_id, variable, value)
+
+    def commit(self, transaction_id, commit_time, horizon=None):
+        return self.call('commit', transaction_id, commit_time, horizon)
+
+    def abort(self, transaction_id):
+        return self.call('abort', transaction_id)
+
+    def collect_garbage(self, horizon=None):
+        return self.call('collect_garbage', horizon)
+
+    def dump(self):
+        return self.call('dump')
+
+
+# Runs num_sites sites in num_workers processes, site i in worker (i - 1) % num_workers.
+class SiteWorkers:
+    def __init__(self, num_sites, num_workers, topology, wait_registry, waits_for_graph, context=None,
+                 durability=None):
+        num_workers = max(1, min(num_workers, num_sites))
+        self.workers = [SiteWorker(topology, context, durability) for _ in range(num_workers)]
+        self.sites = [RemoteSite(i + 1, self.workers[i % num_workers], wait_registry, waits_for_graph, topology,
+                                 durability)
+                      for i in range(num_sites)]
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+def add_site_worker_arguments(parser):
+    parser.add_argument('--site-workers', type=int, default=0,
+                        help='run the sites in this many worker processes, 0 keeps them in this process')
+
+
+# Call method on every site and return the results in site order. Sites in worker processes are all
+# sent the call before any result is awaited, so they run it in parallel.
+def fan_out(sites, method, *args):
+    for site in sites:
+        if isinstance(site, RemoteSite):
+            site.send(method, *args)
+    return [site.receive() if isinstance(site, RemoteSite) else getattr(site, method)(*args) for site in sites]
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from events import NullSink
+from manager_transaction import DETECTION_MODES, TransactionManager
+from server import TransactionServer
+
+# seconds a client may wait for an answer before the test fails
+TIMEOUT = 5
+
+
+# Runs a TransactionServer on a free local port for the length of a test
+class ServerHarness:
+    def __init__(self, manager):
+        self.server = TransactionServer(manager)
+        self.listener = None
+        self.ticker = None
+        self.port = None
+
+    async def __aenter__(self):
+        self.ticker = asyncio.create_task(self.server.run_ticks())
+        self.listener = await asyncio.start_server(self.server.handle_client, '127.0.0.1', 0)
+        self.port = self.listener.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.listener.close()
+        await self.listener.wait_closed()
+        self.ticker.cancel()
+
+    async def connect(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        return LineClient(reader, writer)
+
+
+class LineClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # every line received so far
+        self.lines = []
+
+    # Send one operation without waiting for its answer
+    async def send(self, line):
+        self.writer.write((line + '\n').encode())
+        await self.writer.drain()
+
+    # Lines received up to and including the next 'ok' or error
+    async def answer(self):
+        lines = []
+        while True:
+            line = (await asyncio.wait_for(self.reader.readline(), TIMEOUT)).decode().strip()
+            lines.append(line)
+            self.lines.append(line)
+            if line == 'ok' or line.startswith('error'):
+                return lines
+
+    async def run(self, line):
+        await self.send(line)
+        return await self.answer()
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+class ServerDeadlockTest(unittest.TestCase):
+    # Two clients write x1 and x3 in opposite orders and both block on each other
+    async def deadlock(self, **deadlock_options):
+        manager = TransactionManager(sink=NullSink(), **deadlock_options)
+        async with ServerHarness(manager) as harness:
+            first = await harness.connect()
+            second = await harness.connect()
+            await first.run('begin(T1)')
+            await second.run('begin(T2)')
+            await first.run('W(T1,x1,101)')
+            await second.run('W(T2,x3,303)')
+            await first.send('W(T1,x3,103)')
+            await second.send('W(T2,x1,201)')
+            await asyncio.gather(first.answer(), second.answer())
+            aborts = [line for line in first.lines + second.lines if line.endswith('aborted')]
+            await first.close()
+            await second.close()
+        return aborts
+
+    def test_deadlock_resolves_under_every_detection_mode(self):
+        for detection in DETECTION_MODES:
+            with self.subTest(detection=detection):
+                aborts = asyncio.run(self.deadlock(detection=detection, detect_every=5, wait_timeout=3))
+                self.assertGreater(len(aborts), 0)
+
+    def test_deadlock_is_prevented_by_wound_wait(self):
+        aborts = asyncio.run(self.deadlock(deadlock_policy='wound-wait'))
+        self.assertEqual(aborts, ['T2 aborted'])
+
+
+if __name__ == '__main__':
+    unittest.main()
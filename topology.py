@@ -0,0 +1,134 @@
+import json
+
+DEFAULT_NUM_SITES = 10
+DEFAULT_NUM_VARIABLES = 20
+
+PLACEMENTS = ['default', 'full', 'factor', 'map']
+
+
+# Even variables on every site, odd variable xi only on site i % num_sites + 1.
+class DefaultPlacement:
+    def sites_for(self, index, num_sites):
+        if index % 2 == 0:
+            return range(1, num_sites + 1)
+        return [index % num_sites + 1]
+
+
+# Every variable on every site.
+class FullReplication:
+    def sites_for(self, index, num_sites):
+        return range(1, num_sites + 1)
+
+
+# Variable xi on k consecutive sites, starting from site i % num_sites + 1.
+class ReplicationFactor:
+    def __init__(self, k):
+        if k < 1:
+            raise ValueError(f"replication factor must be at least 1, got {k}")
+        self.k = k
+
+    def sites_for(self, index, num_sites):
+        if self.k >= num_sites:
+            return range(1, num_sites + 1)
+        first = index % num_sites
+        return sorted((first + i) % num_sites + 1 for i in range(self.k))
+
+
+# Explicit map of variable name to the ids of the sites storing it.
+class ExplicitPlacement:
+    def __init__(self, mapping):
+        self.mapping = {variable: sorted(set(site_ids)) for variable, site_ids in mapping.items()}
+
+    def sites_for(self, index, num_sites):
+        return self.mapping.get(variable_name(index), [])
+
+
+def variable_name(index):
+    return 'x' + str(index)
+
+
+def variable_index(variable):
+    return int(variable[1:])
+
+
+# Build a placement policy from its CLI name
+def make_placement(name='default', replication_factor=None, placement_map=None):
+    if name == 'default':
+        return DefaultPlacement()
+    if name == 'full':
+        return FullReplication()
+    if name == 'factor':
+        if replication_factor is None:
+            raise ValueError("placement 'factor' needs a replication factor")
+        return ReplicationFactor(replication_factor)
+    if name == 'map':
+        if placement_map is None:
+            raise ValueError("placement 'map' needs a placement map")
+        if isinstance(placement_map, str):
+            with open(placement_map, 'r') as f:
+                placement_map = json.load(f)
+        return ExplicitPlacement(placement_map)
+    raise ValueError(f"unknown placement: {name}, must be in {PLACEMENTS}")
+
+
+def add_topology_arguments(parser):
+    parser.add_argument('--sites', type=int, default=DEFAULT_NUM_SITES, help='number of sites')
+    parser.add_argument('--variables', type=int, default=DEFAULT_NUM_VARIABLES, help='number of variables')
+    parser.add_argument('--placement', type=str, default='default', choices=PLACEMENTS,
+                        help='replication placement: default (even variables everywhere), full, factor or map')
+    parser.add_argument('-k', '--replication-factor', type=int, help='number of replicas per variable for --placement factor')
+    parser.add_argument('--placement-map', type=str, help='JSON file mapping variable to site ids for --placement map')
+
+
+# Placement policy from parsed arguments
+def placement_from_args(args):
+    return make_placement(args.placement, args.replication_factor, args.placement_map)
+
+
+# Number of sites and variables in the cluster and where each variable is stored.
+class Topology:
+    def __init__(self, num_sites=DEFAULT_NUM_SITES, num_variables=DEFAULT_NUM_VARIABLES, placement=None):
+        if num_sites < 1:
+            raise ValueError(f"need at least one site, got {num_sites}")
+        if num_variables < 0:
+            raise ValueError(f"number of variables can not be negative, got {num_variables}")
+        self.num_sites = num_sites
+        self.num_variables = num_variables
+        self.placement = placement if placement is not None else DefaultPlacement()
+        if isinstance(self.placement, ExplicitPlacement):
+            self._check_map(self.placement.mapping)
+
+    def _check_map(self, mapping):
+        for variable, site_ids in mapping.items():
+            if not 1 <= variable_index(variable) <= self.num_variables:
+                raise ValueError(f"placement map has unknown variable {variable}")
+            for site_id in site_ids:
+                if not 1 <= site_id <= self.num_sites:
+                    raise ValueError(f"placement map puts {variable} on unknown site {site_id}")
+
+    # Ids of the sites storing variable
+    def sites_for(self, variable):
+        if not variable[1:].isdigit():
+            return []
+        index = variable_index(variable)
+        if not 1 <= index <= self.num_variables:
+            return []
+        return self.placement.sites_for(index, self.num_sites)
+
+    # Whether site_id stores variable
+    def stores(self, site_id, variable):
+        return site_id in self.sites_for(variable)
+
+    # Whether variable is replicated beyond a single site
+    def is_replicated(self, variable):
+        return len(self.sites_for(variable)) > 1
+
+    # Value every variable holds before any transaction writes it
+    def initial_value(self, variable):
+        return variable_index(variable) * 10
+
+    # Names of the variables stored at site_id, in index order
+    def site_variables(self, site_id):
+        for index in range(1, self.num_variables + 1):
+            if site_id in self.placement.sites_for(index, self.num_sites):
+                yield variable_name(index)
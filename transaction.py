@@ -1,24 +1,29 @@
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Any, List
+from typing import Any, Set
 
 
 class TransType(Enum):
-    READ_ONLY = 0,
+    READ_ONLY = 0
     READ_WRITE = 1
 
 
 class TransState(Enum):
-    RUNNING = 1,
-    ABORTED = 2,
-    BLOCKED = 3,
+    RUNNING = 1
+    ABORTED = 2
+    BLOCKED = 3
     COMITTED = 4
 
 
-@dataclass
+@dataclass(slots=True)
 class Transaction:
     id_trans: str
     startTime: Any
     transactionType: TransType
     transactionState: TransState
-    sitesAccessed: List = field(default_factory=list)
+    # sites holding this transaction's locks or queued lock requests, where commit and abort are sent
+    sitesAccessed: Set = field(default_factory=set)
+    # sites this transaction has read from or written to, whose failure aborts it
+    sitesTouched: Set = field(default_factory=set)
+    # for read-only transactions, tick of the last read-write commit before they began, naming the versions they see
+    snapshot: Any = None
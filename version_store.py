@@ -0,0 +1,97 @@
+from array import array
+from bisect import bisect_right
+
+
+# Committed versions of a single variable, ordered by commit time. Values and commit times
+# are kept in parallel columns so snapshot lookups are a binary search over the times. The
+# columns are arrays of 64-bit integers, 8 bytes a version; values fall back to a list once
+# a value that is not such an integer is committed.
+class VersionStore:
+    __slots__ = ('values', 'commit_times')
+
+    def __init__(self, value=None, commit_time=None):
+        self.values = array('q')
+        self.commit_times = array('q')
+        if commit_time is not None:
+            self.append(value, commit_time)
+
+    # VersionStore holding the given columns
+    @classmethod
+    def from_columns(cls, values, commit_times):
+        versions = cls()
+        for value, commit_time in zip(values, commit_times):
+            versions.append(value, commit_time)
+        return versions
+
+    def __len__(self):
+        return len(self.commit_times)
+
+    # (value, commit_time) tuples, oldest first
+    def __iter__(self):
+        return zip(self.values, self.commit_times)
+
+    # Add a version committed at commit_time, which is never older than the latest one
+    def append(self, value, commit_time):
+        try:
+            self.values.append(value)
+        except (TypeError, OverflowError):
+            self.values = list(self.values)
+            self.values.append(value)
+        self.commit_times.append(commit_time)
+
+    # Latest committed (value, commit_time)
+    def latest(self):
+        return (self.values[-1], self.commit_times[-1])
+
+    def latest_value(self):
+        return self.values[-1]
+
+    def latest_time(self):
+        return self.commit_times[-1]
+
+    # Last (value, commit_time) committed at or before timestamp, None if there is none
+    def find(self, timestamp):
+        i = bisect_right(self.commit_times, timestamp) - 1
+        if i < 0:
+            return None
+        return (self.values[i], self.commit_times[i])
+
+    # Drop versions no snapshot at or after horizon can read, keeping the newest one
+    # committed at or before horizon. Without a horizon only the latest version is kept.
+    def prune(self, horizon=None):
+        if horizon is None:
+            i = len(self.commit_times) - 1
+        else:
+            i = bisect_right(self.commit_times, horizon) - 1
+        if i > 0:
+            del self.values[:i]
+            del self.commit_times[:i]
+
+
+# Committed versions of every variable stored at a site. A variable that was never touched
+# is not materialized; its initial version is created the first time it is looked up.
+class SiteVersions(dict):
+    def __init__(self, site_id, topology):
+        super().__init__()
+        self.site_id = site_id
+        self.topology = topology
+
+    def __missing__(self, variable):
+        if not self.topology.stores(self.site_id, variable):
+            raise KeyError(variable)
+        versions = VersionStore(self.topology.initial_value(variable), 0)
+        self[variable] = versions
+        return versions
+
+    def __contains__(self, variable):
+        return dict.__contains__(self, variable) or self.topology.stores(self.site_id, variable)
+
+    # Latest committed value of variable without materializing its versions
+    def latest_value(self, variable):
+        if dict.__contains__(self, variable):
+            return self[variable].latest_value()
+        return self.topology.initial_value(variable)
+
+    # Names of all variables stored at this site, in index order
+    def variables(self):
+        return self.topology.site_variables(self.site_id)
@@ -0,0 +1,53 @@
+from collections import defaultdict
+
+
+# Tracks blocked operations by the (site, variable) pairs they are waiting on, so only
+# operations whose lock or site changed state get retried. An operation is dropped from
+# every pair it waits on as soon as one of them wakes it or it is removed.
+class WaitRegistry:
+    def __init__(self):
+        # (site_id, variable) -> operations waiting on that pair, in the order they started waiting
+        self.waiting = defaultdict(dict)
+        # site_id -> set of variables with waiting operations on that site
+        self.site_variables = defaultdict(set)
+        # reverse index: operation -> (site_id, variable) pairs it waits on
+        self.operation_keys = dict()
+
+    # Park operation until something changes for variable at site_id
+    def wait(self, operation, site_id, variable):
+        operation.ready = False
+        self.waiting[(site_id, variable)][operation] = None
+        self.site_variables[site_id].add(variable)
+        self.operation_keys.setdefault(operation, set()).add((site_id, variable))
+
+    # Stop tracking operation under every pair it waits on
+    def remove(self, operation):
+        for key in self.operation_keys.pop(operation, ()):
+            waiters = self.waiting.get(key)
+            if waiters is None:
+                continue
+            waiters.pop(operation, None)
+            if len(waiters) == 0:
+                del self.waiting[key]
+                self.site_variables[key[0]].discard(key[1])
+
+    # Wake all operations waiting on variable at site_id
+    def notify(self, site_id, variable):
+        waiters = self.waiting.pop((site_id, variable), None)
+        if waiters is None:
+            return
+        self.site_variables[site_id].discard(variable)
+        for operation in waiters:
+            operation.ready = True
+            self.remove(operation)
+
+    # Wake all operations waiting on any variable at site_id (site failed or recovered)
+    def notify_site(self, site_id):
+        for variable in list(self.site_variables[site_id]):
+            self.notify(site_id, variable)
+
+    # Drop every waiting operation
+    def clear(self):
+        self.waiting.clear()
+        self.site_variables.clear()
+        self.operation_keys.clear()
@@ -0,0 +1,37 @@
+from collections import Counter, defaultdict
+
+
+# Waits-for graph kept as reference counted (waiter, blocker) edges, so the same edge
+# contributed by several variables or sites only disappears once all of them release it.
+class WaitsForGraph:
+    def __init__(self):
+        # waiter -> Counter of blockers
+        self.edges = defaultdict(Counter)
+        # edges added so far, telling whether the graph may have gained a cycle since it was last searched
+        self.added = 0
+
+    # Add each (waiter, blocker) edge once
+    def add_edges(self, edges):
+        for waiter, blocker in edges:
+            self.edges[waiter][blocker] += 1
+        self.added += len(edges)
+
+    # Remove each (waiter, blocker) edge once
+    def remove_edges(self, edges):
+        for waiter, blocker in edges:
+            blockers = self.edges[waiter]
+            blockers[blocker] -= 1
+            if blockers[blocker] <= 0:
+                del blockers[blocker]
+            if len(blockers) == 0:
+                del self.edges[waiter]
+
+    # Adjacency view of the graph: waiter -> set of transactions it waits for
+    def get_graph(self):
+        graph = defaultdict(set)
+        for waiter, blockers in self.edges.items():
+            graph[waiter] = set(blockers)
+        return graph
+
+    def clear(self):
+        self.edges.clear()
@@ -0,0 +1,107 @@
+import argparse
+import random
+from bisect import bisect_left
+from itertools import accumulate
+
+from topology import DEFAULT_NUM_SITES, DEFAULT_NUM_VARIABLES
+
+
+# Picks variable indexes 1..num_variables, with Zipfian skew when zipf_s > 0
+# (index 1 is the hottest key) and uniformly otherwise.
+class KeyChooser:
+    def __init__(self, num_variables, zipf_s, rng):
+        self.num_variables = num_variables
+        self.rng = rng
+        self.cum_weights = None
+        if zipf_s > 0:
+            self.cum_weights = list(accumulate(1.0 / (i ** zipf_s) for i in range(1, num_variables + 1)))
+
+    def choose(self):
+        if self.cum_weights is None:
+            return self.rng.randint(1, self.num_variables)
+        point = self.rng.random() * self.cum_weights[-1]
+        return min(bisect_left(self.cum_weights, point), self.num_variables - 1) + 1
+
+
+# Generate an interleaved operation stream in the begin/R/W/end/fail/recover grammar.
+# Up to concurrency transactions run at once, each issuing ops_per_transaction reads and
+# writes before its end. Every line, a random up site fails with probability failure_rate
+# and a random down site recovers with probability recovery_rate.
+def generate_workload(num_transactions=100, ops_per_transaction=5, write_fraction=0.5,
+                      readonly_fraction=0.0, zipf_s=0.0, failure_rate=0.0, recovery_rate=0.1,
+                      concurrency=10, num_sites=DEFAULT_NUM_SITES, num_variables=DEFAULT_NUM_VARIABLES,
+                      seed=None, dump=True):
+    rng = random.Random(seed)
+    keys = KeyChooser(num_variables, zipf_s, rng)
+    down_sites = []
+    up_sites = list(range(1, num_sites + 1))
+
+    # transaction id -> (operations left, read-only)
+    running = dict()
+    started = 0
+
+    while started < num_transactions or len(running) > 0:
+        if failure_rate > 0 and len(up_sites) > 1 and rng.random() < failure_rate:
+            site_id = up_sites.pop(rng.randrange(len(up_sites)))
+            down_sites.append(site_id)
+            yield f'fail({site_id})'
+        if len(down_sites) > 0 and rng.random() < recovery_rate:
+            site_id = down_sites.pop(rng.randrange(len(down_sites)))
+            up_sites.append(site_id)
+            yield f'recover({site_id})'
+
+        if started < num_transactions and (len(running) < concurrency or len(running) == 0):
+            started += 1
+            id_trans = f'T{started}'
+            readonly = rng.random() < readonly_fraction
+            running[id_trans] = [ops_per_transaction, readonly]
+            yield f'beginRO({id_trans})' if readonly else f'begin({id_trans})'
+            continue
+
+        id_trans = rng.choice(list(running))
+        state = running[id_trans]
+        if state[0] == 0:
+            del running[id_trans]
+            yield f'end({id_trans})'
+            continue
+        state[0] -= 1
+        variable = f'x{keys.choose()}'
+        if not state[1] and rng.random() < write_fraction:
+            yield f'W({id_trans},{variable},{rng.randint(0, 9999)})'
+        else:
+            yield f'R({id_trans},{variable})'
+
+    for site_id in down_sites:
+        yield f'recover({site_id})'
+    if dump:
+        yield 'dump()'
+
+
+def add_workload_arguments(parser):
+    parser.add_argument('-n', '--transactions', type=int, default=100, help='number of transactions')
+    parser.add_argument('--ops', type=int, default=5, help='reads and writes per transaction')
+    parser.add_argument('--write-fraction', type=float, default=0.5, help='fraction of operations that are writes')
+    parser.add_argument('--readonly-fraction', type=float, default=0.0, help='fraction of read-only transactions')
+    parser.add_argument('--zipf', type=float, default=0.0, help='Zipf exponent of key popularity, 0 for uniform')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='probability per line that a site fails')
+    parser.add_argument('--recovery-rate', type=float, default=0.1, help='probability per line that a down site recovers')
+    parser.add_argument('--concurrency', type=int, default=10, help='transactions running at once')
+    parser.add_argument('--sites', type=int, default=DEFAULT_NUM_SITES, help='number of sites')
+    parser.add_argument('--variables', type=int, default=DEFAULT_NUM_VARIABLES, help='number of variables')
+    parser.add_argument('--seed', type=int, help='random seed')
+
+
+def workload_from_args(args):
+    return generate_workload(args.transactions, args.ops, args.write_fraction, args.readonly_fraction,
+                             args.zipf, args.failure_rate, args.recovery_rate, args.concurrency,
+                             args.sites, args.variables, args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='generate a synthetic workload script')
+    add_workload_arguments(parser)
+
+    args = parser.parse_args()
+    for line in workload_from_args(args):
+        print(line)